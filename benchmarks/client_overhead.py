@@ -0,0 +1,57 @@
+"""
+Накладные расходы на запрос: новый клиент на каждый вызов против общего клиента LinkAI.
+
+Запуск из корня репозитория:
+    python -m benchmarks.client_overhead --requests 200
+"""
+import argparse
+import asyncio
+import time
+
+import openai
+
+from benchmarks.mock_yandex import MockYandex
+from link_ai import LinkAI
+
+
+async def per_call_clients(base_url: str, requests: int) -> float:
+    """Прежнее поведение: клиент и пул соединений создаются на каждый запрос"""
+    start = time.perf_counter()
+    for i in range(requests):
+        client = openai.AsyncOpenAI(api_key="mock", base_url=base_url)
+        await client.responses.create(model="gpt://mock/model", input=f"Пост №{i}")
+        await client.close()
+    return time.perf_counter() - start
+
+
+async def shared_client(ai: LinkAI, requests: int) -> float:
+    start = time.perf_counter()
+    for i in range(requests):
+        await ai.single_prompt(f"Пост №{i}")
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    # Заглушка отвечает без задержки, чтобы измерять только накладные расходы клиента
+    mock = await MockYandex(latency=0).start()
+    ai = LinkAI(base_url=mock.base_url, api_key="mock")
+    try:
+        # Прогрев: первый запрос открывает соединение в общем пуле
+        await ai.single_prompt("прогрев")
+
+        elapsed = await per_call_clients(mock.base_url, args.requests)
+        print(f"Клиент на каждый запрос: {elapsed / args.requests * 1000:.2f} мс/запрос")
+
+        elapsed = await shared_client(ai, args.requests)
+        print(f"Общий клиент LinkAI:     {elapsed / args.requests * 1000:.2f} мс/запрос")
+    finally:
+        await ai.close()
+        await mock.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Запросы к БД в секунду: соединение на каждый запрос против пула с асинхронным доступом.
+Нужна запущенная MySQL с настройками из .env (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME).
+
+Запуск из корня репозитория:
+    python -m benchmarks.db_pool --queries 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import mysql.connector
+from dotenv import load_dotenv
+
+from database import Database, AsyncDatabase
+
+
+def connect_per_query(config: dict, queries: int, user_id: int):
+    """Прежнее поведение: новое подключение к MySQL на каждый запрос"""
+    for _ in range(queries):
+        conn = mysql.connector.connect(**config)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
+        cursor.fetchone()
+        conn.close()
+
+
+async def pooled(db: AsyncDatabase, queries: int, concurrency: int, user_id: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await db.user_exists(user_id)
+
+    await asyncio.gather(*(one() for _ in range(queries)))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    load_dotenv()
+    config = {
+        "host": os.getenv('DB_HOST'),
+        "user": os.getenv('DB_USER'),
+        "password": os.getenv('DB_PASSWORD'),
+        "database": os.getenv('DB_NAME')
+    }
+
+    start = time.perf_counter()
+    connect_per_query(config, args.queries, args.user_id)
+    elapsed = time.perf_counter() - start
+    print(f"Подключение на запрос: {args.queries / elapsed:.1f} запр/с")
+
+    db = AsyncDatabase(Database(config, pool_size=args.pool_size))
+    try:
+        # Прогрев: пул открывает соединения при первом обращении
+        await db.user_exists(args.user_id)
+        start = time.perf_counter()
+        await pooled(db, args.queries, args.concurrency, args.user_id)
+        elapsed = time.perf_counter() - start
+        print(f"Пул ({args.pool_size}) + async: {args.queries / elapsed:.1f} запр/с")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
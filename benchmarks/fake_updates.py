@@ -0,0 +1,48 @@
+"""Генератор синтетических обновлений Telegram в формате Bot API"""
+import itertools
+import time
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}", "username": f"user{user_id}"}
+
+
+def message_update(user_id: int, text: str) -> dict:
+    """Обновление с текстовым сообщением пользователя в личном чате"""
+    update = {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return update
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    """Обновление с нажатием inline-кнопки под сообщением бота"""
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bot"},
+                "text": "…",
+            },
+        },
+    }
@@ -0,0 +1,58 @@
+"""
+Пропускная способность LinkAI при N одновременных пользователях.
+
+Запуск из корня репозитория:
+    python -m benchmarks.llm_concurrency --users 50 --latency 0.5
+"""
+import argparse
+import asyncio
+import time
+
+import openai
+
+from benchmarks.mock_yandex import MockYandex
+from link_ai import LinkAI
+
+
+def blocking_baseline(base_url: str, users: int):
+    """Прежнее поведение: синхронный клиент на каждый запрос, запросы идут друг за другом"""
+    for i in range(users):
+        client = openai.OpenAI(api_key="mock", base_url=base_url)
+        client.responses.create(model="gpt://mock/model", input=f"Пост №{i}")
+        client.close()
+
+
+async def async_users(ai: LinkAI, users: int):
+    await asyncio.gather(*(ai.single_prompt(f"Пост №{i}") for i in range(users)))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    mock = await MockYandex(latency=args.latency).start()
+    ai = LinkAI(base_url=mock.base_url, api_key="mock")
+    try:
+        if not args.skip_baseline:
+            start = time.perf_counter()
+            # Сервер-заглушка живёт в этом же цикле событий, поэтому блокирующий клиент уводим в поток
+            await asyncio.to_thread(blocking_baseline, mock.base_url, args.users)
+            elapsed = time.perf_counter() - start
+            print(f"Блокирующий клиент: {args.users} запросов за {elapsed:.2f} с "
+                  f"({args.users / elapsed:.1f} запр/с)")
+
+        start = time.perf_counter()
+        await async_users(ai, args.users)
+        elapsed = time.perf_counter() - start
+        print(f"Асинхронный LinkAI:  {args.users} запросов за {elapsed:.2f} с "
+              f"({args.users / elapsed:.1f} запр/с)")
+    finally:
+        await ai.close()
+        await mock.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
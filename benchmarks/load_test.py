@@ -0,0 +1,341 @@
+"""
+Нагрузочный тест TextBot без выхода в сеть.
+Поднимает заглушки Yandex Cloud (модель и генерация изображений) и Telegram Bot API,
+прогоняет через Dispatcher сценарии виртуальных пользователей и печатает p50/p95/p99 и пропускную способность.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --users 50 --iterations 3 --latency 0.5 --distribution lognormal
+    python -m benchmarks.load_test --mix solo:3,dialogue:2,upgrader:2,settings:1,image:1 --error-rate 0.05
+    # с MySQL из .env вместо БД в памяти
+    python -m benchmarks.load_test --db mysql
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from benchmarks.fake_updates import message_update, callback_update
+from benchmarks.mock_telegram import MockTelegram
+from benchmarks.mock_yandex import MockYandex, DISTRIBUTIONS
+
+
+class RestImageResult:
+    def __init__(self, image_bytes: bytes):
+        self.image_bytes = image_bytes
+
+
+class RestImageOperation:
+    def __init__(self, model, operation_id: str):
+        self.model = model
+        self.id = operation_id
+
+    async def wait(self, timeout: float = 120, poll_interval: float = 1):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            async with self.model.session.get(f"{self.model.root_url}/operations/{self.id}") as resp:
+                resp.raise_for_status()
+                operation = await resp.json()
+            if operation.get("done"):
+                return RestImageResult(base64.b64decode(operation["response"]["image"]))
+            await asyncio.sleep(poll_interval)
+        raise asyncio.TimeoutError(f"Операция {self.id} не завершилась за {timeout} с")
+
+
+class RestImageModel:
+    """
+    Модель генерации изображений поверх REST API отложенных операций.
+    Тот же интерфейс run_deferred/wait, что у модели из yandex_cloud_ml_sdk, но без gRPC —
+    так LinkAI.draw работает с локальной заглушкой
+    """
+
+    def __init__(self, root_url: str):
+        self.root_url = root_url
+        self.session = aiohttp.ClientSession()
+
+    async def run_deferred(self, prompt: str) -> RestImageOperation:
+        body = {"modelUri": "art://mock/yandex-art/latest", "messages": [{"text": prompt, "weight": 1}]}
+        async with self.session.post(f"{self.root_url}/foundationModels/v1/imageGenerationAsync", json=body) as resp:
+            resp.raise_for_status()
+            return RestImageOperation(self, (await resp.json())["id"])
+
+    async def close(self):
+        await self.session.close()
+
+
+# Сценарии пользователей: шаги (метка, функция user_id -> обновление)
+def _message(text: str):
+    return lambda user_id: message_update(user_id, text)
+
+
+def _callback(data: str):
+    return lambda user_id: callback_update(user_id, data)
+
+
+def solo_journey(questions_count: int) -> list:
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🔥 Разовый запрос")),
+        ("generate", _message("Напиши пост о сборе тёплых вещей для подопечных")),
+    ]
+
+
+def dialogue_journey(questions_count: int) -> list:
+    steps = [("start", _message("/start")), ("menu", _message("❓ Запрос с уточнениями"))]
+    for number in range(1, questions_count + 1):
+        steps.append(("answer", _message(f"Ответ на вопрос {number}: подробности для поста")))
+    steps.append(("generate", _callback("finish")))
+    return steps
+
+
+def upgrader_journey(questions_count: int) -> list:
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🗂️ Доп. функции")),
+        ("menu", _message("📝 Улучшение текста")),
+        ("text", _message("Мы проводим благотворительную ярмарку в субботу приходите все")),
+        ("upgrade", _callback("up_1")),
+        ("upgrade", _callback("up_3")),
+        ("upgrade", _callback("up_4")),
+        ("finish", _callback("stop")),
+    ]
+
+
+def pipeline_journey(questions_count: int) -> list:
+    """Несколько улучшений одним запросом, затем варианты рядом"""
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🗂️ Доп. функции")),
+        ("menu", _message("📝 Улучшение текста")),
+        ("text", _message("Мы проводим благотворительную ярмарку в субботу приходите все")),
+        ("select", _callback("pipe")),
+        ("select", _callback("pipe_1")),
+        ("select", _callback("pipe_3")),
+        ("select", _callback("pipe_4")),
+        ("upgrade", _callback("pipe_run")),
+        ("select", _callback("pipe")),
+        ("select", _callback("pipe_2")),
+        ("select", _callback("pipe_3")),
+        ("variants", _callback("pipe_variants")),
+        ("pick", _callback("pick_0")),
+        ("finish", _callback("stop")),
+    ]
+
+
+def settings_journey(questions_count: int) -> list:
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🛠️ Настройки генерации")),
+        ("settings", _callback("stile")),
+        ("settings", _callback(f"stile_select_{random.randint(1, 3)}")),
+        ("save", _callback("save")),
+        ("settings", _callback("tone")),
+        ("settings", _callback(f"tone_select_{random.randint(1, 3)}")),
+        ("save", _callback("save")),
+        ("settings", _callback("org_info_use")),
+        ("finish", _callback("to_menu")),
+    ]
+
+
+def chat_journey(questions_count: int) -> list:
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("💬 Мульти чат")),
+        ("first", _message("Помоги придумать пост о нашем новом проекте")),
+        ("follow_up", _message("Сделай короче")),
+        ("follow_up", _message("Добавь призыв прийти на встречу")),
+        ("follow_up", _message("А теперь вариант для ВКонтакте")),
+        ("finish", _message("🏠 В меню")),
+    ]
+
+
+def image_journey(questions_count: int) -> list:
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🗂️ Доп. функции")),
+        ("menu", _message("🏞️ Генерация изображения")),
+        ("draw", _message("Волонтёры раздают горячий чай зимой")),
+    ]
+
+
+def plan_journey(questions_count: int) -> list:
+    """Контент-план уходит в очередь задач, результат присылает воркер"""
+    return [
+        ("start", _message("/start")),
+        ("menu", _message("🗂️ Доп. функции")),
+        ("menu", _message("📅 Генерация контент плана")),
+        ("enqueue", _message("План на месяц, два поста в неделю, аудитория — волонтёры")),
+    ]
+
+
+JOURNEYS = {
+    "solo": solo_journey,
+    "dialogue": dialogue_journey,
+    "upgrader": upgrader_journey,
+    "pipeline": pipeline_journey,
+    "settings": settings_journey,
+    "image": image_journey,
+    "chat": chat_journey,
+    "plan": plan_journey,
+}
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition(":")
+        if name not in JOURNEYS:
+            raise SystemExit(f"Неизвестный сценарий {name}, доступны: {', '.join(JOURNEYS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def print_table(title: str, samples: dict):
+    print(f"\n{title}")
+    print(f"{'':<22}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for name, values in sorted(samples.items()):
+        print(f"{name:<22}{len(values):>7}" + "".join(
+            f"{percentile(values, p) * 1000:>10.0f}" for p in (50, 95, 99, 100)))
+
+
+def create_bot(args, mock: MockYandex, telegram: MockTelegram):
+    """TextBot, подключённый к заглушкам; окружение задаётся до импорта bot, т.к. LinkAI читает его при импорте"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:LOAD-TEST",
+        "API_KEY": "mock",
+        "CLOUD_FOLDER": "mock",
+        "MODEL": "mock",
+        "API_BASE_URL": mock.base_url,
+        "FSM_STORAGE": args.fsm,
+        "FSM_SQLITE_PATH": args.fsm_path,
+        "JOB_QUEUE_PATH": args.jobs_path,
+        "TELEGRAM_CHAT_RATE": str(args.telegram_chat_rate),
+        "TELEGRAM_CHAT_BURST": str(args.telegram_chat_rate),
+        "JOB_WORKERS": str(args.job_workers),
+        "METRICS_PORT": "",
+        "STREAM_RESPONSES": "1" if args.stream else "0",
+        "LLM_MAX_IN_FLIGHT": str(args.max_in_flight),
+        "DRAW_POLL_INTERVAL": str(args.image_poll),
+        # Кэш ответов исказил бы замер: в сценариях повторяются одни и те же тексты
+        "RESPONSE_CACHE_OPERATIONS": "",
+    })
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    import profiling
+    from bot import TextBot
+
+    text_bot = TextBot()
+    text_bot.bot = Bot(token=os.environ["BOT_TOKEN"],
+                       session=AiohttpSession(api=TelegramAPIServer.from_base(telegram.base_url)))
+    text_bot.bot.session.middleware(profiling.telegram_middleware)
+    text_bot.bot.session.middleware(text_bot.sender)
+    if args.db == "memory":
+        from benchmarks.memory_db import MemoryDatabase
+        text_bot.db.db = MemoryDatabase(delay=args.db_delay)
+    text_bot.ai._image_model = RestImageModel(mock.root_url)
+    return text_bot
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=3, help="сценариев на пользователя")
+    parser.add_argument("--mix", default="solo:3,dialogue:2,upgrader:2,settings:2,image:1,chat:2,plan:1")
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза пользователя между шагами, с")
+    parser.add_argument("--latency", type=float, default=0.5, help="средняя задержка модели, с")
+    parser.add_argument("--distribution", choices=sorted(DISTRIBUTIONS), default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-statuses", default="429,500,503")
+    parser.add_argument("--image-latency", type=float, default=3.0)
+    parser.add_argument("--image-poll", type=float, default=0.5)
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-chat-rate", type=float, default=1000,
+                        help="лимит сообщений в секунду на чат; 1 — как у настоящего Telegram")
+    parser.add_argument("--max-in-flight", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="потоковая выдача ответов")
+    parser.add_argument("--db", choices=("memory", "mysql"), default="memory")
+    parser.add_argument("--db-delay", type=float, default=0.002, help="время запроса к БД в памяти, с")
+    parser.add_argument("--fsm", choices=("memory", "sqlite", "mysql"), default="memory")
+    parser.add_argument("--fsm-path", default="load_test_fsm.sqlite3")
+    parser.add_argument("--jobs-path", default="load_test_jobs.sqlite3")
+    parser.add_argument("--job-workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+
+    mock = await MockYandex(latency=args.latency, distribution=args.distribution, error_rate=args.error_rate,
+                            error_statuses=[int(code) for code in args.error_statuses.split(",")],
+                            image_latency=args.image_latency).start()
+    telegram = await MockTelegram(latency=args.telegram_latency).start()
+    text_bot = create_bot(args, mock, telegram)
+
+    import metrics
+    from aiogram.types import Update
+    from config import CONFIG
+
+    questions_count = CONFIG.current.questions_count
+    step_latency = defaultdict(list)
+    journey_latency = defaultdict(list)
+    updates = 0
+
+    async def feed(update: dict):
+        await text_bot.dp.feed_update(text_bot.bot, Update.model_validate(update, context={"bot": text_bot.bot}))
+
+    async def user(user_id: int):
+        nonlocal updates
+        for _ in range(args.iterations):
+            name = random.choices(list(mix), weights=list(mix.values()))[0]
+            journey_start = time.perf_counter()
+            for label, make_update in JOURNEYS[name](questions_count):
+                if args.think:
+                    await asyncio.sleep(random.expovariate(1 / args.think))
+                start = time.perf_counter()
+                await feed(make_update(user_id))
+                step_latency[f"{name}:{label}"].append(time.perf_counter() - start)
+                updates += 1
+            journey_latency[name].append(time.perf_counter() - journey_start)
+
+    try:
+        await text_bot.db.migrate()
+        await text_bot.jobs.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(user(2_000_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+        # Картинки и контент-планы хендлеры только ставят в очередь: ждём, пока воркеры их доделают
+        await text_bot.jobs.join()
+        drained = time.perf_counter() - start
+    finally:
+        await text_bot.ai._image_model.close()
+        await text_bot.bot.session.close()
+        await text_bot.close()
+        await telegram.stop()
+        await mock.stop()
+
+    journeys = sum(len(values) for values in journey_latency.values())
+    print(f"Пользователей: {args.users}, сценариев: {journeys}, обновлений: {updates} за {elapsed:.2f} с")
+    print(f"Пропускная способность: {updates / elapsed:.1f} обновл/с, {journeys / elapsed:.2f} сценариев/с")
+    print(f"Запросов к модели: {mock.requests}, к генерации изображений: {mock.image_requests}, "
+          f"внедрённых ошибок: {mock.errors}, вызовов Bot API: {sum(telegram.calls.values())}")
+    print(f"Ошибок в хендлерах: {metrics.HANDLER_ERRORS.total():.0f}")
+    print(f"Фоновых задач выполнено: {text_bot.jobs.done}, с ошибкой: {text_bot.jobs.failed}, "
+          f"очередь разобрана через {drained:.2f} с")
+    print_table("Шаги сценариев", step_latency)
+    print_table("Сценарии целиком", journey_latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
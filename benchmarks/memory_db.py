@@ -0,0 +1,119 @@
+import threading
+import time
+
+from database import Database
+
+
+class MemoryDatabase(Database):
+    """
+    Database в памяти процесса для нагрузочного теста без MySQL.
+    Повторяет ответы методов Database; delay имитирует время запроса к БД
+    """
+
+    def __init__(self, pool_size: int = 10, delay: float = 0.002):
+        super().__init__({}, pool_size=pool_size)
+        self.delay = delay
+        self.users = {}
+        self.organizations = {}
+        self._lock = threading.Lock()
+
+    def _query(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+    def create_users_table(self):
+        self._query()
+
+    def register_user(self, user_id: int, username: str, full_name: str, is_admin: bool = False) -> bool:
+        self._query()
+        with self._lock:
+            if user_id in self.users:
+                return False
+            organization_id = len(self.organizations) + 1
+            self.organizations[organization_id] = {
+                "organization_name": f"Организация {full_name}",
+                "organization_info_data": "Не указано",
+                "system_prompt": None,
+                "system_role": None,
+                "system_prompt_version": 0,
+            }
+            self.users[user_id] = {
+                "username": username,
+                "full_name": full_name,
+                "is_admin": is_admin,
+                "organization": organization_id,
+                "settings": {"set_org_info": 1, "set_style_type": 1, "set_size": 1, "set_tone": 1},
+            }
+            return True
+
+    def _organization(self, user_id: int):
+        user = self.users.get(user_id)
+        return self.organizations.get(user["organization"]) if user else None
+
+    def is_admin(self, user_id: int) -> bool:
+        self._query()
+        user = self.users.get(user_id)
+        return user["is_admin"] if user else False
+
+    def user_exists(self, user_id: int) -> bool:
+        self._query()
+        return user_id in self.users
+
+    def get_admins_id(self):
+        self._query()
+        return [user_id for user_id, user in self.users.items() if user["is_admin"]]
+
+    def get_user_settings(self, user_id: int) -> dict:
+        self._query()
+        user = self.users.get(user_id)
+        return dict(user["settings"]) if user else {}
+
+    def organization_info_reload(self, user_id: int, new_info: str):
+        self._query()
+        organization = self._organization(user_id)
+        if organization:
+            organization["organization_info_data"] = new_info
+
+    def add_administrator(self, username: str):
+        self._query()
+        for user in self.users.values():
+            if user["username"] == username:
+                user["is_admin"] = True
+        return True
+
+    def get_organization_info(self, user_id: int):
+        self._query()
+        organization = self._organization(user_id)
+        if organization is None:
+            return None
+        return organization["organization_info_data"], organization["organization_name"]
+
+    def set_user_settings(self, user_id: int, settings: dict):
+        self._query()
+        user = self.users.get(user_id)
+        if not user:
+            return False
+        user["settings"] = {key: settings[key] for key in user["settings"]}
+        return True
+
+    def migrate(self) -> list:
+        self._query()
+        return []
+
+    def get_system_prompt(self, user_id: int):
+        self._query()
+        organization = self._organization(user_id)
+        if organization is None:
+            return None
+        return organization["system_prompt"], organization["system_role"], organization["system_prompt_version"]
+
+    def save_system_prompt(self, user_id: int, system_prompt: str, system_role: str = None):
+        self._query()
+        organization = self._organization(user_id)
+        if organization is None:
+            return False
+        organization["system_prompt"] = system_prompt
+        if system_role is not None:
+            organization["system_role"] = system_role
+        organization["system_prompt_version"] += 1
+        return True
@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Методы Bot API, которые возвращают отправленное или изменённое сообщение
+MESSAGE_METHODS = {"sendmessage", "editmessagetext", "editmessagereplymarkup", "sendphoto", "senddocument"}
+
+
+class MockTelegram:
+    """
+    Локальная заглушка Telegram Bot API: принимает любые вызовы бота и отвечает успехом.
+    Подключается к aiogram через TelegramAPIServer.from_base(mock.base_url)
+    """
+
+    def __init__(self, latency: float = 0.02, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self._message_ids = itertools.count(1_000_000)
+        self._runner = None
+
+        self.app = web.Application(client_max_size=50 * 1024 ** 2)
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "multipart/form-data":
+            params = {}
+            async for part in await request.multipart():
+                # Файлы не разбираем, нужны только простые поля
+                params[part.name] = (await part.text()) if part.filename is None else None
+            return params
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if method not in MESSAGE_METHODS:
+            return web.json_response({"ok": True, "result": True})
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "bot"},
+        }
+        if method == "sendphoto":
+            message["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]
+        elif method == "senddocument":
+            message["document"] = {"file_id": "document", "file_unique_id": "document"}
+        else:
+            message["text"] = params.get("text") or "…"
+        return web.json_response({"ok": True, "result": message})
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,198 @@
+import asyncio
+import base64
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+
+# Картинка 1x1 JPEG, которую отдаёт заглушка генерации изображений
+PIXEL_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAgGBgcGBQgHBwcJCQgKDBQNDAsLDBkSEw8UHRofHh0aHBwgJC4nICIsIxwcKDcpLDAxNDQ0"
+    "Hyc5PTgyPC4zNDL/wAALCAABAAEBAREA/8QAFAABAAAAAAAAAAAAAAAAAAAACf/EABQQAQAAAAAAAAAAAAAAAAAAAAD/2gAIAQEAAD8A"
+    "KP/Z"
+)
+
+# Распределения задержки: значение — функция от средней задержки
+DISTRIBUTIONS = {
+    "fixed": lambda mean: mean,
+    "uniform": lambda mean: random.uniform(0.5 * mean, 1.5 * mean),
+    "exponential": lambda mean: random.expovariate(1 / mean) if mean > 0 else 0,
+    # Длинный хвост, как у реальных запросов к модели: медиана ниже среднего
+    "lognormal": lambda mean: random.lognormvariate(0, 0.75) * mean / 1.325,
+}
+
+
+class MockYandex:
+    """
+    Локальная заглушка Yandex Cloud для бенчмарков без выхода в сеть:
+    /v1/responses и REST API отложенной генерации изображений (imageGenerationAsync + operations)
+    """
+
+    def __init__(self, latency: float = 0.5, host: str = "127.0.0.1", port: int = 0,
+                 error_rate: float = 0, error_status: int = 503, distribution: str = "fixed",
+                 error_statuses: tuple = None, image_latency: float = 3):
+        self.latency = latency
+        self.distribution = DISTRIBUTIONS[distribution]
+        # Внедрение ошибок: доля запросов с ошибкой и их коды; down=True — сервис лежит целиком
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_statuses = tuple(error_statuses or (error_status,))
+        self.down = False
+        self.errors = 0
+        self.image_latency = image_latency
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.image_requests = 0
+        self._ids = itertools.count(1)
+        self._operations = {}
+        # Выданные id ответов: на неизвестный previous_response_id заглушка отвечает 404, как API
+        self._response_ids = set()
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/v1/responses", self.responses)
+        self.app.router.add_post("/foundationModels/v1/imageGenerationAsync", self.image_generation)
+        self.app.router.add_get("/operations/{operation_id}", self.operation)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    @property
+    def root_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def delay(self, mean: float = None) -> float:
+        return max(self.distribution(self.latency if mean is None else mean), 0)
+
+    def _failed(self) -> bool:
+        return self.down or random.random() < self.error_rate
+
+    def _error(self) -> web.Response:
+        self.errors += 1
+        status = random.choice(self.error_statuses)
+        return web.json_response(
+            {"error": {"message": "Ошибка, внедрённая заглушкой", "type": "mock_error", "code": status}},
+            status=status)
+
+    def _response(self, body: dict, text: str) -> dict:
+        response_id = f"resp_{next(self._ids)}"
+        self._response_ids.add(response_id)
+        return {
+            "id": response_id,
+            "previous_response_id": body.get("previous_response_id"),
+            "object": "response",
+            "created_at": int(time.time()),
+            "model": body.get("model", ""),
+            "status": "completed",
+            "output": [{
+                "type": "message",
+                "id": "msg_1",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }],
+            "usage": {
+                "input_tokens": len(str(body.get("input", ""))) // 4,
+                "output_tokens": len(text) // 4,
+                "total_tokens": (len(str(body.get("input", ""))) + len(text)) // 4,
+            },
+        }
+
+    async def responses(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        delay = self.delay()
+        if self._failed():
+            await asyncio.sleep(delay)
+            return self._error()
+        previous = body.get("previous_response_id")
+        if previous and previous not in self._response_ids:
+            await asyncio.sleep(delay)
+            return web.json_response(
+                {"error": {"message": f"Response {previous} not found", "type": "not_found", "code": 404}},
+                status=404)
+        text = f"Ответ заглушки на запрос длиной {len(str(body.get('input', '')))} символов"
+
+        if body.get("stream"):
+            return await self._stream(request, body, text, delay)
+
+        await asyncio.sleep(delay)
+        return web.json_response(self._response(body, text))
+
+    async def image_generation(self, request: web.Request) -> web.Response:
+        """Запуск отложенной генерации изображения: сразу возвращает операцию"""
+        await request.read()
+        self.image_requests += 1
+        await asyncio.sleep(self.delay(0.05))
+        if self._failed():
+            return self._error()
+        operation_id = f"op_{next(self._ids)}"
+        self._operations[operation_id] = time.monotonic() + self.delay(self.image_latency)
+        return web.json_response({"id": operation_id, "done": False})
+
+    async def operation(self, request: web.Request) -> web.Response:
+        """Статус операции: готово, когда прошло время генерации"""
+        operation_id = request.match_info["operation_id"]
+        ready_at = self._operations.get(operation_id)
+        if ready_at is None:
+            return web.json_response({"error": "operation not found"}, status=404)
+        if time.monotonic() < ready_at:
+            return web.json_response({"id": operation_id, "done": False})
+        del self._operations[operation_id]
+        return web.json_response({
+            "id": operation_id,
+            "done": True,
+            "response": {"image": base64.b64encode(PIXEL_JPEG).decode(), "modelVersion": "mock"},
+        })
+
+    async def _stream(self, request: web.Request, body: dict, text: str, delay: float) -> web.StreamResponse:
+        """Отдаёт ответ событиями SSE по словам, равномерно растягивая задержку"""
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+
+        async def send(event: dict):
+            await resp.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+
+        final = self._response(body, text)
+        await send({"type": "response.created", "sequence_number": 0,
+                    "response": {**final, "status": "in_progress", "output": []}})
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay / len(words))
+            await send({"type": "response.output_text.delta", "sequence_number": i + 1, "item_id": "msg_1",
+                        "output_index": 0, "content_index": 0, "delta": word + (" " if i < len(words) - 1 else ""),
+                        "logprobs": []})
+        await send({"type": "response.completed", "sequence_number": len(words) + 1, "response": final})
+        await resp.write_eof()
+        return resp
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 ОС выдаёт свободный порт
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+async def main():
+    mock = await MockYandex().start()
+    print(f"Заглушка запущена: {mock.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await mock.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
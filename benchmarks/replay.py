@@ -0,0 +1,140 @@
+"""
+Повтор журнала запросов к модели (REQUEST_JOURNAL_PATH) против заглушки или настоящего API.
+Воспроизводит операции, параметры и, с --speed, исходные интервалы между запросами;
+сравнивает задержки и статусы с записанными.
+
+Запуск из корня репозитория:
+    python -m benchmarks.replay journal/requests.jsonl --mock --latency 0.5 --speed 0
+    python -m benchmarks.replay journal/requests.jsonl.1 journal/requests.jsonl --speed 2 --concurrency 20
+    # настоящий API: ключ и каталог из .env
+    python -m benchmarks.replay journal/requests.jsonl --base-url https://rest-assistant.api.cloud.yandex.net/v1
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+from benchmarks.load_test import RestImageModel, percentile
+from benchmarks.mock_yandex import MockYandex, DISTRIBUTIONS
+from journal import read_journal
+from link_ai import LinkAI
+from response_cache import ResponseCache
+
+
+def load_entries(paths: list, operations: set, include_cached: bool, limit: int) -> list:
+    entries = []
+    for path in paths:
+        for entry in read_journal(path):
+            if operations and entry["operation"] not in operations:
+                continue
+            # Ответы из кэша до модели не доходили, повторять их незачем
+            if entry.get("cached") and not include_cached:
+                continue
+            entries.append(entry)
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries[:limit] if limit else entries
+
+
+async def replay_one(ai: LinkAI, entry: dict, model: str = None):
+    request = dict(entry["request"])
+    if entry["operation"] == "draw":
+        return await ai.draw(request["prompt"])
+    if model:
+        request["model"] = model
+    if entry.get("stream"):
+        async with await ai._create(entry["operation"], stream=True, **request) as stream:
+            async for _ in stream:
+                pass
+        if stream.response is None:
+            raise RuntimeError("Поток оборвался до response.completed")
+        return stream.response
+    return await ai._create(entry["operation"], **request)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("journals", nargs="+", help="файлы журнала, в том числе ротированные")
+    parser.add_argument("--mock", action="store_true", help="повторять против локальной заглушки")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--distribution", choices=sorted(DISTRIBUTIONS), default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--base-url", default=None, help="адрес API, по умолчанию API_BASE_URL из .env")
+    parser.add_argument("--model", default=None, help="подменить модель из журнала")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 — исходный темп, 2 — вдвое быстрее, 0 — без пауз")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--operations", default="", help="только эти операции, через запятую")
+    parser.add_argument("--include-cached", action="store_true")
+    parser.add_argument("--limit", type=int, default=0)
+    args = parser.parse_args()
+
+    entries = load_entries(args.journals, {op for op in args.operations.split(",") if op},
+                           args.include_cached, args.limit)
+    if not entries:
+        print("В журнале нет подходящих записей")
+        return
+
+    mock = None
+    if args.mock:
+        mock = await MockYandex(latency=args.latency, distribution=args.distribution,
+                                error_rate=args.error_rate).start()
+    ai = LinkAI(base_url=mock.base_url if mock else args.base_url, api_key="mock" if mock else None)
+    # Повтор не пишет сам себя в журнал, идёт в модель из журнала (или --model) и всегда доходит до неё
+    ai.journal = None
+    ai.router = None
+    ai.response_cache.close()
+    ai.response_cache = ResponseCache()
+    if mock:
+        ai._image_model = RestImageModel(mock.root_url)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    replayed = defaultdict(list)
+    recorded = defaultdict(list)
+    errors = defaultdict(int)
+    regressions = defaultdict(int)
+
+    async def run(entry: dict, delay: float):
+        await asyncio.sleep(delay)
+        operation = entry["operation"]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await replay_one(ai, entry, args.model)
+            except Exception as e:
+                errors[operation] += 1
+                if entry["status"] == "ok":
+                    regressions[operation] += 1
+                    print(f"{operation}: был успешен, при повторе {e!r}")
+                return
+            finally:
+                replayed[operation].append(time.perf_counter() - start)
+        if entry["status"] == "ok" and not entry.get("cached"):
+            recorded[operation].append(entry["latency"])
+
+    first = entries[0]["ts"]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            run(entry, (entry["ts"] - first) / args.speed if args.speed else 0) for entry in entries))
+    finally:
+        elapsed = time.perf_counter() - start
+        if mock:
+            await ai._image_model.close()
+        await ai.close()
+        if mock:
+            await mock.stop()
+
+    print(f"Повторено запросов: {len(entries)} за {elapsed:.2f} с ({len(entries) / elapsed:.1f} запр/с), "
+          f"ошибок: {sum(errors.values())}, из них новых: {sum(regressions.values())}")
+    print(f"\n{'':<28}{'n':>6}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"
+          f"{'было p50':>10}{'было p95':>10}")
+    for operation in sorted(replayed):
+        values, before = replayed[operation], recorded[operation]
+        line = f"{operation:<28}{len(values):>6}{errors[operation]:>8}"
+        line += "".join(f"{percentile(values, p) * 1000:>10.0f}" for p in (50, 95, 99))
+        line += "".join(f"{percentile(before, p) * 1000:>10.0f}" if before else f"{'—':>10}" for p in (50, 95))
+        print(line)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
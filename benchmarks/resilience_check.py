@@ -0,0 +1,68 @@
+"""
+Проверка повторов и автомата LinkAI на заглушке с внедрением ошибок.
+
+Запуск из корня репозитория:
+    python -m benchmarks.resilience_check --requests 200 --error-rate 0.3
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.mock_yandex import MockYandex
+from link_ai import LinkAI
+from resilience import CircuitOpenError
+
+
+async def run(ai: LinkAI, requests: int) -> dict:
+    results = await asyncio.gather(*(ai.single_prompt(f"Пост №{i}") for i in range(requests)),
+                                   return_exceptions=True)
+    outcome = {"ok": 0, "circuit_open": 0, "failed": 0}
+    for result in results:
+        if isinstance(result, CircuitOpenError):
+            outcome["circuit_open"] += 1
+        elif isinstance(result, Exception):
+            outcome["failed"] += 1
+        else:
+            outcome["ok"] += 1
+    return outcome
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    mock = await MockYandex(latency=args.latency, error_rate=args.error_rate,
+                            error_status=args.error_status).start()
+    ai = LinkAI(base_url=mock.base_url, api_key="mock")
+    ai.resilience.base_delay = 0.05
+    ai.resilience.reset_timeout = 1
+    try:
+        start = time.perf_counter()
+        print(f"Случайные ошибки {args.error_rate:.0%}:", await run(ai, args.requests),
+              f"за {time.perf_counter() - start:.2f} с")
+
+        # Сервис лежит: автомат должен разомкнуться и отвечать отказом без обращения к заглушке
+        mock.down = True
+        for wave in (1, 2):
+            before = mock.requests
+            print(f"Сервис недоступен, волна {wave}:", await run(ai, args.requests),
+                  f"обращений к заглушке: {mock.requests - before}")
+
+        # Сервис поднялся: после reset_timeout пробный запрос замыкает автомат
+        mock.down = False
+        mock.error_rate = 0
+        await asyncio.sleep(ai.resilience.reset_timeout)
+        await ai.single_prompt("пробный запрос")
+        print("После восстановления:", await run(ai, args.requests))
+        print("Метрики:", ai.resilience.stats())
+    finally:
+        await ai.close()
+        await mock.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
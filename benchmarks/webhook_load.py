@@ -0,0 +1,58 @@
+"""
+Нагрузка на вебхук бота синтетическими обновлениями Telegram.
+Меряет время подтверждения обновлений (ответ 200) и пропускную способность.
+
+Запуск бота: BOT_MODE=webhook python bot.py
+Запуск нагрузки из корня репозитория:
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8080/webhook --updates 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+import aiohttp
+
+from benchmarks.fake_updates import message_update
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=os.getenv('WEBHOOK_SECRET'))
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = 0
+
+    async def send(session: aiohttp.ClientSession, i: int):
+        nonlocal errors
+        update = message_update(1_000_000 + i % args.users, "/help")
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(send(session, i) for i in range(args.updates)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"Обновлений: {args.updates}, ошибок: {errors}, {args.updates / elapsed:.1f} обн/с")
+    print(f"Подтверждение: p50={quantiles[49] * 1000:.1f} мс, p95={quantiles[94] * 1000:.1f} мс, "
+          f"p99={quantiles[98] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
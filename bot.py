@@ -1,24 +1,41 @@
 import asyncio
-import json
 import os
-import pathlib
+import time
 
+import openai
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, BufferedInputFile, ErrorEvent
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 from yandex.cloud.searchapi.v2.img_search_service_pb2_grpc import ImageSearchService
 
-from database import Database
+import metrics
+import profiling
+from config import CONFIG
+from content_batch import parse_plan, expand_plan, build_document
+from database import Database, AsyncDatabase
+from fsm_storage import SQLiteStorage, MySQLStorage
+from jobs import JobQueue
+from prompt_store import SystemPromptStore
+from resilience import CIRCUIT_STATES, CircuitOpenError
+from scheduler import FairScheduler
+from sender import EMPTY_TEXT, TelegramSender, split_text
 from link_ai import LinkAI
 
 
 class TextBot:
     """Класс бота для генерации текста с настройками"""
 
+    # Максимальная длина сообщения Telegram
+    MESSAGE_LIMIT = 4096
+
     keyboard_quest = InlineKeyboardMarkup(
         inline_keyboard=[
             [InlineKeyboardButton(text="⬅️", callback_data="back"),
@@ -48,13 +65,22 @@ class TextBot:
             [InlineKeyboardButton(text="• Красиво", callback_data="up_1")],
             [InlineKeyboardButton(text="• Другими словами", callback_data="up_2")],
             [InlineKeyboardButton(text="• Кратко", callback_data="up_3")],
-            [InlineKeyboardButton(text="• Проще", callback_data="up_4")]
+            [InlineKeyboardButton(text="• Проще", callback_data="up_4")],
+            [InlineKeyboardButton(text="🧩 Несколько улучшений сразу", callback_data="pipe")]
         ]
     )
+    # Улучшения для выбора нескольких сразу: номер кнопки -> (метод LinkAI, подпись)
+    UPGRADE_BUTTONS = {
+        "1": ("upgrade", "Красиво"),
+        "2": ("rewrite", "Другими словами"),
+        "3": ("shorter", "Кратко"),
+        "4": ("easier", "Проще"),
+    }
     keyboard_main = ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="🔥 Разовый запрос"), KeyboardButton(text="🗂️ Доп. функции")],
             [KeyboardButton(text="❓ Запрос с уточнениями"), KeyboardButton(text="🛠️ Настройки генерации")],
+            [KeyboardButton(text="💬 Мульти чат")],
         ],
         resize_keyboard=True,  # Подгонка под размер
         one_time_keyboard=True  # Скрыть после нажатия
@@ -68,11 +94,17 @@ class TextBot:
         one_time_keyboard=True  # Скрыть после нажатия
     )
 
+    keyboard_chat = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="🆕 Новый диалог"), KeyboardButton(text="🏠 В меню")]],
+        resize_keyboard=True
+    )
+
     class PromptStates(StatesGroup):
         """Состояния для FSM"""
         waiting_for_prompt = State()
         waiting_for_picture_prompt = State()
         waiting_for_content_plane_prompt = State()
+        waiting_for_chat_message = State()
 
     class MainMenu(StatesGroup):
         mane_state = State()
@@ -99,7 +131,6 @@ class TextBot:
         load_dotenv()
 
         self.bot = Bot(token=os.getenv('BOT_TOKEN'))
-        self.dp = Dispatcher()
 
         # Храним последние message_id для удаления
         self.user_last_messages = {}
@@ -113,13 +144,65 @@ class TextBot:
         }
 
         self.ai = LinkAI()
-
-        self.db = Database(DB_CONFIG)
-        # self.db.create_users_table()
+        # Потоковая выдача ответов: одно сообщение правится не чаще раза в STREAM_EDIT_INTERVAL секунд
+        self.stream_responses = os.getenv('STREAM_RESPONSES', '1') == '1'
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
+        # Очередь генераций: не больше LLM_MAX_IN_FLIGHT одновременно и одна на пользователя.
+        # Сами вызовы модели (в том числе параллельные внутри одной генерации) ограничивает LinkAI
+        self.scheduler = FairScheduler(int(os.getenv('LLM_MAX_IN_FLIGHT', 10)))
+        # Пакетная генерация постов: сколько постов пишется одновременно и сколько всего из одного плана
+        self.content_batch_concurrency = int(os.getenv('CONTENT_BATCH_CONCURRENCY', 5))
+        self.content_batch_limit = int(os.getenv('CONTENT_BATCH_LIMIT', 40))
+        # Мульти чат: через сколько секунд простоя цепочка ответов начинается заново
+        self.multi_chat_ttl = float(os.getenv('MULTI_CHAT_TTL', 1800))
+        # Исходящие сообщения: общий лимит бота, лимит на чат и число повторов после 429
+        self.sender = TelegramSender(
+            rate=float(os.getenv('TELEGRAM_RATE', 30)),
+            chat_rate=float(os.getenv('TELEGRAM_CHAT_RATE', 1)),
+            group_rate=float(os.getenv('TELEGRAM_GROUP_RATE', 20 / 60)),
+            chat_burst=float(os.getenv('TELEGRAM_CHAT_BURST', 5)),
+            max_retries=int(os.getenv('TELEGRAM_MAX_RETRIES', 3))
+        )
+        # Очередь долгих генераций: переживает перезапуск, результат воркер присылает в чат сам
+        self.jobs = JobQueue(
+            os.getenv('JOB_QUEUE_PATH', 'jobs.sqlite3'),
+            workers=int(os.getenv('JOB_WORKERS', 4)),
+            max_attempts=int(os.getenv('JOB_MAX_ATTEMPTS', 2)),
+            lease=float(os.getenv('JOB_LEASE', 60))
+        )
+        # Профилирование апдейтов: лог медленных и выборочные снимки cProfile
+        self.profiler = profiling.ProfilingMiddleware(
+            slow_threshold=float(os.getenv('PROFILE_SLOW_THRESHOLD', 2)),
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+            dump_dir=os.getenv('PROFILE_DIR', 'profiles'),
+            max_dumps=int(os.getenv('PROFILE_MAX_DUMPS', 100))
+        )
+        # Метрики для Prometheus на локальном порту; пустой METRICS_PORT отключает сервер
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = os.getenv('METRICS_PORT', '9100')
+        self.metrics_runner = None
+        metrics.REGISTRY.add_collector(self.collect_metrics)
+
+        self.db = AsyncDatabase(Database(DB_CONFIG, pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+                                         health_check=os.getenv('DB_POOL_HEALTH_CHECK', '1') == '1'),
+                                cache_size=int(os.getenv('DB_CACHE_SIZE', 10000)),
+                                cache_ttl=float(os.getenv('DB_CACHE_TTL', 60)))
+        self.prompts = SystemPromptStore(self.db, self.ai)
+
+        self.dp = Dispatcher(storage=self._create_storage())
 
         # Регистрация обработчиков
         self._register_handlers()
 
+    def _create_storage(self):
+        """Хранилище FSM по FSM_STORAGE из .env: memory, sqlite или mysql"""
+        kind = os.getenv('FSM_STORAGE', 'memory')
+        if kind == "sqlite":
+            return SQLiteStorage(os.getenv('FSM_SQLITE_PATH', 'fsm.sqlite3'))
+        if kind == "mysql":
+            return MySQLStorage(self.db)
+        return MemoryStorage()
+
     def _register_handlers(self):
         """Регистрация всех обработчиков сообщений"""
         # Обработчики команд
@@ -127,10 +210,14 @@ class TextBot:
         self.dp.message.register(self.cmd_admin, Command("admin"))
         self.dp.message.register(self.cmd_help, Command("help"))
 
+        # Пакетная генерация постов по контент-плану: кнопка работает в любом состоянии
+        self.dp.callback_query.register(self.content_plan_expand, F.data.startswith("plan_expand_"))
+
         # Обработчики состояний
         self.dp.message.register(self.process_prompt, self.PromptStates.waiting_for_prompt)
         self.dp.message.register(self.picture_generator, self.PromptStates.waiting_for_picture_prompt)
         self.dp.message.register(self.content_plane_generator, self.PromptStates.waiting_for_content_plane_prompt)
+        self.dp.message.register(self.multi_chat_message, self.PromptStates.waiting_for_chat_message)
 
         # Обработчики для вопросов
         self.dp.message.register(self.handle_quest_text, self.QuestState.to_text_answer)
@@ -157,6 +244,53 @@ class TextBot:
         self.dp.message.register(self.text_upgrader, self.UpGradeState.to_settings)
         self.dp.callback_query.register(self.text_upgrader_hendler, StateFilter(self.UpGradeState.to_settings))
 
+        # Ошибки в любом обработчике
+        self.dp.errors.register(self.error_handler)
+
+        # Фоновые задачи
+        self.jobs.register("picture", self.job_picture, self.job_failed)
+        self.jobs.register("content_plan", self.job_content_plan, self.job_failed)
+        self.jobs.register("plan_expand", self.job_plan_expand, self.job_failed)
+        self.jobs.register("org_role", self.job_org_role)
+
+        # Время, число выполняющихся и ошибки по каждому хендлеру
+        self.dp.message.middleware(metrics.handler_middleware)
+        self.dp.callback_query.middleware(metrics.handler_middleware)
+
+        # Полное время апдейта с разбивкой на БД, модель и Telegram
+        self.dp.update.outer_middleware(self.profiler)
+        self.dp.message.middleware(profiling.handler_middleware)
+        self.dp.callback_query.middleware(profiling.handler_middleware)
+        self.bot.session.middleware(profiling.telegram_middleware)
+        # Лимиты Telegram на отправку и повтор после retry_after для всех исходящих сообщений
+        self.bot.session.middleware(self.sender)
+
+    def collect_metrics(self):
+        """Снимает состояние планировщика, кэшей и автоматов для /metrics"""
+        metrics.SCHEDULER_IN_FLIGHT.set(self.scheduler.in_flight)
+        metrics.SCHEDULER_QUEUED.set(self.scheduler.queued)
+        for name, stats in self.db.cache_stats().items():
+            metrics.CACHE_HIT_RATE.set(stats["hit_rate"], cache=name)
+        metrics.CACHE_HIT_RATE.set(self.ai.response_cache.stats()["hit_rate"], cache="response")
+        metrics.CACHE_HIT_RATE.set(self.ai.tokens.compacted.stats()["hit_rate"], cache="org_info_compacted")
+        for service, state in self.ai.resilience.stats()["circuits"].items():
+            metrics.CIRCUIT_STATE.set(CIRCUIT_STATES[state], service=service)
+
+    async def error_handler(self, event: ErrorEvent, state: FSMContext = None):
+        """Сообщить пользователю об ошибке и вернуть его в главное меню, не оставляя полусброшенное состояние"""
+        update = event.update
+        print(f"Ошибка при обработке обновления {update.update_id}: {event.exception!r}")
+        message = update.message or (update.callback_query.message if update.callback_query else None)
+        if message is None or state is None:
+            return
+        if isinstance(event.exception, CircuitOpenError):
+            text = "⚠️ Сервис генерации сейчас недоступен. Попробуйте, пожалуйста, через пару минут."
+        else:
+            text = "⚠️ Не удалось выполнить запрос. Попробуйте ещё раз."
+        await state.clear()
+        await message.answer(text)
+        await self.main_menu(message, state)
+
     async def main_menu(self, message: types.Message, state: FSMContext):
         await message.answer("Главное меню :",
                              reply_markup=self.keyboard_main)
@@ -179,6 +313,9 @@ class TextBot:
         elif text == "❓ Запрос с уточнениями":
             await state.clear()
             await self.handle_question_quest(message, state)
+        elif text == "💬 Мульти чат":
+            await state.clear()
+            await self.handle_multi_quest(message, state)
         elif text == "🏞️ Генерация изображения":
             await state.clear()
             await self.picture_promt_listen(message, state)
@@ -204,13 +341,13 @@ class TextBot:
         #     )
 
         await state.clear()
-        if not self.db.is_admin(message.from_user.id):
+        if not await self.db.is_admin(message.from_user.id):
             await message.answer("Доступ запрещен")
             return
 
         # Вставить административные функции здесь
         mane_mass = await message.answer("Панель администратора", reply_markup=self.keyboard_admin)
-        await state.update_data(mane_mass=mane_mass)
+        await state.update_data(mane_mass=mane_mass.message_id)
         await state.set_state(self.MainMenu.adm_settings)
         return
 
@@ -224,7 +361,7 @@ class TextBot:
             return
         else:
 
-            result = self.db.add_administrator(message.text[1::] if message.text[0] == "@" else message.text)
+            result = await self.db.add_administrator(message.text[1::] if message.text[0] == "@" else message.text)
             if result:
                 await message.answer("Администратор добавлен")
             else:
@@ -245,16 +382,19 @@ class TextBot:
         else:
 
             result = message.text
-            # result = self.ai.create_system_prompt(result).output_text
-            self.db.organization_info_reload(message.from_user.id, result)
+            # result = (await self.ai.create_system_prompt(result)).output_text
+            await self.db.organization_info_reload(message.from_user.id, result)
 
             await message.answer("Данные обновлены")
+            # Роль НКО для системного промпта собирается один раз здесь, а не при каждой генерации,
+            # в очереди задач, как и остальные запросы к модели
+            await self.jobs.enqueue("org_role", message.chat.id, message.from_user.id, {"info": result})
         await state.clear()
         await self.main_menu(message, state)
         return
 
     async def org_info(self, message: types.Message, state: FSMContext):
-        info = self.db.get_organization_info(message.from_user.id)
+        info = await self.db.get_organization_info(message.from_user.id)
 
         await message.message.answer(f"Название : \n{info[1]}\n\nОписание : \n{info[0]}")
         await state.clear()
@@ -270,13 +410,13 @@ class TextBot:
     async def cmd_start(self, message: types.Message, state: FSMContext):
         """Команда старта с регистрацией"""
         user = message.from_user
-        if not self.db.user_exists(user.id):
-            self.db.register_user(
-                user_id=user.id,
-                username=user.username,
-                full_name=user.full_name,
-                is_admin=True
-            )
+        # Процедура сама проверяет, есть ли пользователь: один запрос к БД вместо двух-трёх
+        await self.db.register_user(
+            user_id=user.id,
+            username=user.username,
+            full_name=user.full_name,
+            is_admin=True
+        )
 
         await message.answer(f"Добро пожаловать {message.from_user.full_name}! Выберите режим для начала работы:",
                              reply_markup=self.keyboard_main)
@@ -320,9 +460,10 @@ class TextBot:
             """
             text + up_1/2/... --> улучшение --> result
             """
-            result = self.ai.upgrade(text).output_text
+            async with self.llm_slot(callback.message):
+                result = (await self.ai.upgrade(text)).output_text
 
-            await callback.message.answer(result)
+            await self.answer_long(callback.message, result)
             await state.update_data(text=result)
             await state.update_data(state="again_quest")
             await self.text_upgrader(callback.message, state)
@@ -332,9 +473,10 @@ class TextBot:
             """
             text + up_1/2/... --> улучшение --> result
             """
-            result = self.ai.rewrite(text).output_text
+            async with self.llm_slot(callback.message):
+                result = (await self.ai.rewrite(text)).output_text
 
-            await callback.message.answer(result)
+            await self.answer_long(callback.message, result)
             await state.update_data(text=result)
             await state.update_data(state="again_quest")
             await self.text_upgrader(callback.message, state)
@@ -344,9 +486,10 @@ class TextBot:
             """
             text + up_1/2/... --> улучшение --> result
             """
-            result = self.ai.shorter(text).output_text
+            async with self.llm_slot(callback.message):
+                result = (await self.ai.shorter(text)).output_text
 
-            await callback.message.answer(result)
+            await self.answer_long(callback.message, result)
             await state.update_data(text=result)
             await state.update_data(state="again_quest")
             await self.text_upgrader(callback.message, state)
@@ -356,9 +499,65 @@ class TextBot:
             """
             text + up_1/2/... --> улучшение --> result
             """
-            result = self.ai.easier(text).output_text
+            async with self.llm_slot(callback.message):
+                result = (await self.ai.easier(text)).output_text
 
-            await callback.message.answer(result)
+            await self.answer_long(callback.message, result)
+            await state.update_data(text=result)
+            await state.update_data(state="again_quest")
+            await self.text_upgrader(callback.message, state)
+
+        elif callback.data == "pipe":
+            await state.update_data(pipeline=[])
+            await callback.message.edit_text("Отметьте улучшения в нужном порядке:",
+                                             reply_markup=self.keyboard_pipeline([]))
+        elif callback.data == "pipe_back":
+            await callback.message.edit_text("Выберите нужное улучшение :", reply_markup=self.keyboard_param_upgrader)
+        elif callback.data in ("pipe_run", "pipe_variants"):
+            pipeline = data.get("pipeline", [])
+            if not pipeline:
+                await callback.message.edit_text("Отметьте хотя бы одно улучшение:",
+                                                 reply_markup=self.keyboard_pipeline(pipeline))
+                return
+            steps = [self.UPGRADE_BUTTONS[key][0] for key in pipeline]
+            labels = " → ".join(self.UPGRADE_BUTTONS[key][1] for key in pipeline)
+            if callback.data == "pipe_run":
+                # Все шаги одной генерацией вместо цепочки запросов
+                await callback.message.edit_text(f"Улучшаю текст: {labels}")
+                async with self.llm_slot(callback.message):
+                    result = (await self.ai.upgrade_pipeline(text, steps)).output_text
+
+                await self.answer_long(callback.message, result)
+                await state.update_data(text=result)
+                await state.update_data(state="again_quest")
+                await self.text_upgrader(callback.message, state)
+            else:
+                # Каждое улучшение отдельно от исходного текста, запросы идут параллельно;
+                # слот планировщика один на пользователя, а каждый запрос проходит общий лимит LinkAI
+                await callback.message.edit_text(f"Готовлю варианты: {labels.replace(' → ', ', ')}")
+                async with self.llm_slot(callback.message):
+                    variants = await self.ai.upgrade_variants(text, steps)
+
+                for number, (key, (_, result)) in enumerate(zip(pipeline, variants), 1):
+                    await self.answer_long(callback.message,
+                                           f"Вариант {number} — {self.UPGRADE_BUTTONS[key][1]}:\n\n"
+                                           f"{result or 'Не удалось получить вариант'}")
+                await state.update_data(variants=[result for _, result in variants])
+                keyboard_pick = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text=f"Взять вариант {number}", callback_data=f"pick_{number - 1}")]
+                    for number, (_, result) in enumerate(variants, 1) if result
+                ] + [[InlineKeyboardButton(text="✅ Завершить", callback_data="stop")]])
+                await callback.message.answer("Какой вариант улучшать дальше?", reply_markup=keyboard_pick)
+        elif callback.data.startswith("pipe_"):
+            key = callback.data[len("pipe_"):]
+            pipeline = data.get("pipeline", [])
+            pipeline = [item for item in pipeline if item != key] if key in pipeline else pipeline + [key]
+            await state.update_data(pipeline=pipeline)
+            await callback.message.edit_text("Отметьте улучшения в нужном порядке:",
+                                             reply_markup=self.keyboard_pipeline(pipeline))
+        elif callback.data.startswith("pick_"):
+            result = data["variants"][int(callback.data[len("pick_"):])]
+            await callback.message.edit_text("Вариант выбран")
             await state.update_data(text=result)
             await state.update_data(state="again_quest")
             await self.text_upgrader(callback.message, state)
@@ -374,6 +573,81 @@ class TextBot:
 
 
 
+    def keyboard_pipeline(self, pipeline: list) -> InlineKeyboardMarkup:
+        """Клавиатура выбора нескольких улучшений; у выбранных — номер шага"""
+        rows = []
+        for key, (_, label) in self.UPGRADE_BUTTONS.items():
+            mark = f"✅ {pipeline.index(key) + 1}." if key in pipeline else "•"
+            rows.append([InlineKeyboardButton(text=f"{mark} {label}", callback_data=f"pipe_{key}")])
+        rows.append([InlineKeyboardButton(text="▶️ Одним запросом", callback_data="pipe_run"),
+                     InlineKeyboardButton(text="🔀 Варианты рядом", callback_data="pipe_variants")])
+        rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="pipe_back")])
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    async def org_context(self, user_id: int) -> str:
+        """Информация об организации для промптов: собранная роль НКО, а если её ещё нет — данные из БД"""
+        _, role = await self.prompts.get(user_id)
+        if role:
+            return role
+        return (await self.db.get_organization_info(user_id))[1]
+
+    def llm_slot(self, message: types.Message):
+        """Слот планировщика на генерацию для чата message; ожидающему сообщаем место в очереди"""
+        async def on_queued(ahead: int):
+            await message.answer(f"⏳ Сейчас много запросов, ваш в очереди. Перед вами: {ahead}")
+
+        return self.scheduler.slot(message.chat.id, on_queued)
+
+    async def answer_long(self, message: types.Message, text: str, **kwargs):
+        """Ответ любой длины: текст длиннее лимита Telegram уходит несколькими сообщениями по абзацам"""
+        return await self.sender.send(self.bot, message.chat.id, text, **kwargs)
+
+    async def answer_generation(self, message: types.Message, method, *args) -> str:
+        """
+        Отправляет ответ модели пользователю.
+        В потоковом режиме показывает текст по мере генерации, редактируя одно сообщение
+        """
+        text, _ = await self.answer_response(message, method, *args)
+        return text
+
+    async def answer_response(self, message: types.Message, method, *args):
+        """Как answer_generation, но возвращает ещё и id ответа модели (None, если поток оборвался)"""
+        async with self.llm_slot(message):
+            if not self.stream_responses:
+                response = await method(*args)
+                await self.answer_long(message, response.output_text)
+                return response.output_text, response.id
+            # Заглушку отправляем до открытия потока: если отправка не удалась, запрос к модели не начат
+            placeholder = await message.answer("✍️ Пишу ответ...")
+            async with await method(*args, stream=True) as stream:
+                text = await self._answer_stream(message, placeholder, stream)
+            return text, stream.response.id if stream.response is not None else None
+
+    async def _answer_stream(self, message: types.Message, placeholder: types.Message, stream) -> str:
+        shown = ""
+        next_edit = 0.0
+        async for _ in stream:
+            text = stream.text[:self.MESSAGE_LIMIT]
+            if not text.strip() or text == shown or time.monotonic() < next_edit:
+                continue
+            try:
+                await placeholder.edit_text(text)
+                shown = text
+                next_edit = time.monotonic() + self.stream_edit_interval
+            except TelegramRetryAfter as e:
+                # Не ждём внутри потока, просто откладываем следующую правку
+                next_edit = time.monotonic() + e.retry_after
+            except TelegramBadRequest:
+                pass
+
+        text = stream.text if stream.text.strip() else EMPTY_TEXT
+        parts = split_text(text, self.MESSAGE_LIMIT)
+        if parts[0] != shown:
+            await placeholder.edit_text(parts[0])
+        for part in parts[1:]:
+            await message.answer(part)
+        return text
+
     async def handle_solo_quest(self, message: types.Message, state: FSMContext):
         """Обработчик кнопки 'Одиночный запрос'"""
         await state.clear()
@@ -388,16 +662,25 @@ class TextBot:
         data["prompt"] = message.text
 
         # Вставить пользовательскую функцию обработки здесь
-        settings = self.db.get_user_settings(message.from_user.id)
-        info = self.db.get_organization_info(message.from_user.id)[1]
-        system_prompt = info + "Используй при создании постов хештэги."
-        result = self.ai.prompt_with_system_context(self.ai.prompt_from_settings(settings) + message.text + "Используй хештэги только из описания организации и указанные выше", system_prompt)
-
+        prompt, system_prompt = await self.user_prompt(message.from_user.id, message.text)
         await state.clear()
-        await message.answer(result.output_text)
+        await self.answer_generation(message, self.ai.prompt_with_system_context, prompt, system_prompt)
         await self.main_menu(message, state)
         return
 
+    async def user_prompt(self, user_id: int, text: str):
+        """Промпт пользователя и системный промпт с настройками и информацией об организации"""
+        system_prompt, _ = await self.prompts.get(user_id)
+        if system_prompt:
+            # Собранный заранее промпт уже содержит настройки и описание организации
+            return text + "Используй хештэги только из описания организации и указанные выше", system_prompt
+        settings, info = await asyncio.gather(self.db.get_user_settings(user_id),
+                                              self.db.get_organization_info(user_id))
+        info = info[1]
+        system_prompt = info + "Используй при создании постов хештэги."
+        prompt = self.ai.prompt_from_settings(settings) + text + "Используй хештэги только из описания организации и указанные выше"
+        return prompt, system_prompt
+
     async def handle_question_quest(self, message: types.Message, state: FSMContext):
         data = await state.get_data()
         if "quest" not in data:
@@ -408,21 +691,17 @@ class TextBot:
             await state.update_data(finish=0)
             data["finish"] = 0
             await state.update_data(quest_data={})
-            with open('settings.json', 'r', encoding='utf-8') as file:
-                quests_0 = json.load(file)
-            quests = quests_0['questions']
-            await state.update_data(quests=quests)
-            data["quests"] = quests
-            await state.update_data(quests_count=len(quests))
-            data["quests_count"] = len(quests)
+            # Сами вопросы берутся из конфигурации, в FSM хранится только их число
+            quests_count = CONFIG.current.questions_count
+            await state.update_data(quests_count=quests_count)
+            data["quests_count"] = quests_count
             await state.update_data(not_one=0)
             data["not_one"] = 0
-        quests = data["quests"]
+        quests = CONFIG.current.questions
 
         if data["finish"] == 1:
-            info = self.db.get_organization_info(message.from_user.id)[1]
-            resp = self.ai.dialogue(data["quest_data"], info)
-            await message.answer(resp.output_text)
+            info = await self.org_context(message.from_user.id)
+            await self.answer_generation(message, self.ai.dialogue, data["quest_data"], info)
             await state.clear()
             await self.main_menu(message, state)
             return
@@ -436,10 +715,10 @@ class TextBot:
                                                       InlineKeyboardButton(text="➡️", callback_data="next")]
 
         if data["not_one"] == 1:
-            await message.edit_text(quests[str(data["quest"])]["text"], reply_markup=self.keyboard_quest)
+            await message.edit_text(quests[data["quest"]], reply_markup=self.keyboard_quest)
 
         else:
-            await message.answer(quests[str(data["quest"])]["text"], reply_markup=self.keyboard_quest)
+            await message.answer(quests[data["quest"]], reply_markup=self.keyboard_quest)
             await state.update_data(not_one=1)
         await state.set_state(self.QuestState.to_text_answer)
         return
@@ -453,9 +732,8 @@ class TextBot:
             await state.update_data(quest=data["quest"] - 1)
         elif callback.data == "finish":
             await self.bot.delete_message(chat_id=callback.from_user.id, message_id=callback.message.message_id)
-            info = self.db.get_organization_info(callback.from_user.id)[1]
-            resp = self.ai.dialogue(data["quest_data"], info)
-            await callback.message.answer(resp.output_text)
+            info = await self.org_context(callback.from_user.id)
+            await self.answer_generation(callback.message, self.ai.dialogue, data["quest_data"], info)
             await state.clear()
             await self.main_menu(callback.message, state)
             return
@@ -482,29 +760,60 @@ class TextBot:
 
         await self.handle_question_quest(message, state)
 
-    async def handle_multi_quest(self, message: types.Message):
+    async def handle_multi_quest(self, message: types.Message, state: FSMContext):
         """Обработчик кнопки 'Мульти чат'"""
         await message.answer("Выбран режим: Мульти чат")
-        # Здесь ваша логика для мульти чата
+        await message.answer("Пишите сообщения, я помню предыдущие ответы в этом диалоге:",
+                             reply_markup=self.keyboard_chat)
+        await state.set_state(self.PromptStates.waiting_for_chat_message)
+
+    async def multi_chat_message(self, message: types.Message, state: FSMContext):
+        """
+        Сообщение в мульти чате.
+        Первое сообщение уходит с системным промптом, следующие — только новой репликой со ссылкой
+        на предыдущий ответ (previous_response_id): историю диалога хранит API, а не бот
+        """
+        if message.text == "🏠 В меню":
+            await state.clear()
+            await self.main_menu(message, state)
+            return
+        data = await state.get_data()
+        response_id = data.get("chat_response_id")
+        if message.text == "🆕 Новый диалог":
+            await state.update_data(chat_response_id=None)
+            await message.answer("Начинаем новый диалог")
+            return
+        if response_id and time.time() - data.get("chat_last_at", 0) > self.multi_chat_ttl:
+            response_id = None
+            await message.answer("Прошлый диалог давно не продолжался, начинаем новый")
+
+        if response_id:
+            try:
+                _, new_id = await self.answer_response(message, self.ai.prompt_with_user_context,
+                                                       message.text, response_id)
+                await state.update_data(chat_response_id=new_id, chat_last_at=time.time())
+                return
+            except (openai.BadRequestError, openai.NotFoundError) as e:
+                # API мог уже удалить сохранённый ответ: начинаем цепочку заново
+                print(f"Не удалось продолжить диалог {response_id}: {e!r}")
+
+        prompt, system_prompt = await self.user_prompt(message.from_user.id, message.text)
+        _, new_id = await self.answer_response(message, self.ai.prompt_with_system_context, prompt, system_prompt)
+        await state.update_data(chat_response_id=new_id, chat_last_at=time.time())
 
     async def picture_promt_listen(self, message: types.Message, state: FSMContext):
         await message.answer("Опишите, что вы хотите нарисовать")
         await state.set_state(self.PromptStates.waiting_for_picture_prompt)
 
     async def picture_generator(self, message: types.Message, state: FSMContext):
-        prompt = message.text
-        result = "pictures/picture.jpg"  # Эту строчку замени
-        path = pathlib.Path(result)
-        try:
-            resp = await self.ai.draw(prompt)
-            path.write_bytes(resp.image_bytes)
-        finally:
-            pass
         await state.clear()
-        await message.answer_photo(FSInputFile(result))
-        # await message.answer("Создать изображение по новой?")
+        await self.start_job(message, message.from_user.id, "picture", {"prompt": message.text})
         await self.main_menu(message, state)
 
+    async def job_picture(self, job: dict):
+        # Картинка остаётся в памяти: у каждого запроса свой результат, без общего файла на диске
+        resp = await self.ai.draw(job["payload"]["prompt"])
+        await self.bot.send_photo(job["chat_id"], BufferedInputFile(resp.image_bytes, filename="picture.jpg"))
 
     async def content_plane_promt_listen(self, message: types.Message, state: FSMContext):
         await message.answer(
@@ -512,23 +821,89 @@ class TextBot:
         await state.set_state(self.PromptStates.waiting_for_content_plane_prompt)
 
     async def content_plane_generator(self, message: types.Message, state: FSMContext):
-        prompt = message.text
-        info = self.db.get_organization_info(message.from_user.id)[1]
-        result = self.ai.content_plan(prompt, info)
-
         await state.clear()
-        await message.answer(result.output_text)
+        await self.start_job(message, message.from_user.id, "content_plan", {"prompt": message.text})
         await self.main_menu(message, state)
         return
 
+    async def job_content_plan(self, job: dict):
+        user_id, chat_id = job["user_id"], job["chat_id"]
+        info = await self.org_context(user_id)
+        async with self.scheduler.slot(user_id):
+            plan = (await self.ai.content_plan(job["payload"]["prompt"], info)).output_text
+        await self.sender.send(self.bot, chat_id, plan)
+        # План хранится вместе с задачей, кнопка ссылается на неё: состояние диалога к тому времени могут сбросить
+        await self.jobs.set_result(job["id"], plan)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📝 Написать все посты по плану", callback_data=f"plan_expand_{job['id']}")]
+        ])
+        await self.bot.send_message(chat_id, "Можно сразу написать все посты из плана одним документом:",
+                                    reply_markup=keyboard)
+
+    async def content_plan_expand(self, callback: CallbackQuery, state: FSMContext):
+        """Ставит в очередь посты по всем пунктам сохранённого контент-плана"""
+        await callback.answer()
+        plan = await self.jobs.get_result(int(callback.data.split("_")[-1]), callback.from_user.id)
+        await callback.message.edit_reply_markup(reply_markup=None)
+        if not plan:
+            await callback.message.answer("Контент-план не найден, составьте его заново")
+            return
+        await self.start_job(callback.message, callback.from_user.id, "plan_expand", {"plan": plan})
+
+    async def job_plan_expand(self, job: dict):
+        """Пишет посты по всем пунктам контент-плана параллельно и присылает одним документом"""
+        user_id, chat_id, plan = job["user_id"], job["chat_id"], job["payload"]["plan"]
+        system_prompt, _ = await self.prompts.get(user_id)
+        if system_prompt:
+            settings, info = {}, system_prompt
+        else:
+            settings, info = await asyncio.gather(self.db.get_user_settings(user_id),
+                                                  self.db.get_organization_info(user_id))
+            info = info[1]
+        async with self.scheduler.slot(user_id):
+            entries = parse_plan(plan)
+            if not entries:
+                entries = parse_plan((await self.ai.structure_plan(plan)).output_text)
+            if not entries:
+                await self.bot.send_message(chat_id, "Не удалось разобрать контент-план на отдельные посты")
+                return
+            entries = entries[:self.content_batch_limit]
+            await self.bot.send_message(chat_id, f"Пишу посты: {len(entries)} шт. Это займёт около минуты")
+            posts = await expand_plan(self.ai, entries, settings, info, self.content_batch_concurrency)
+
+        await self.bot.send_document(chat_id, BufferedInputFile(build_document(posts), filename="posts.txt"),
+                                     caption=f"Готово постов: {sum(1 for _, text in posts if text)} из {len(posts)}")
+
+    async def job_org_role(self, job: dict):
+        """Строит роль организации по новому описанию; пока её нет, промпты берут описание как есть"""
+        user_id, info = job["user_id"], job["payload"]["info"]
+        current = await self.db.get_organization_info(user_id)
+        if not current or current[0] != info:
+            # Описание успели поменять ещё раз, роль построит следующая задача
+            return
+        async with self.scheduler.slot(user_id):
+            await self.prompts.rebuild(user_id, info)
+
+    async def start_job(self, message: types.Message, user_id: int, kind: str, payload: dict):
+        """Поставить долгую генерацию в очередь и сразу ответить, что она в работе"""
+        ahead = await self.jobs.enqueue(kind, message.chat.id, user_id, payload)
+        text = "⏳ Запрос в работе, пришлю результат сюда, как только он будет готов."
+        if ahead:
+            text += f" Перед ним в очереди: {ahead}"
+        await message.answer(text)
+
+    async def job_failed(self, job: dict, error: Exception):
+        if isinstance(error, CircuitOpenError):
+            text = "⚠️ Сервис генерации сейчас недоступен. Попробуйте, пожалуйста, через пару минут."
+        else:
+            text = "⚠️ Не удалось выполнить запрос. Попробуйте ещё раз."
+        await self.bot.send_message(job["chat_id"], text)
+
     async def settings(self, message: types.Message, state: FSMContext):
         """Обработчик кнопки 'Настройки'"""
         if "not_first" not in await state.get_data():
             await state.update_data(not_first=1)
-            with open('settings.json', 'r', encoding='utf-8') as file:
-                settings_list = json.load(file)["settings"]
-            await state.update_data(settings_list=settings_list)
-            await state.update_data(settings=self.db.get_user_settings(message.from_user.id))
+            await state.update_data(settings=await self.db.get_user_settings(message.from_user.id))
             await message.answer("Настройки генерации:", reply_markup=self.keyboard_settings_mane)
             await state.update_data(state="main")
 
@@ -540,23 +915,24 @@ class TextBot:
 
     async def settings_handler(self, callback: CallbackQuery, state: FSMContext):
         data = await state.get_data()
+        config = CONFIG.current
         await callback.answer()
 
         if callback.data == "stile" or data["state"] == "to_stile":
             keyboard_stile_gen = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_style_type"]) else ""), callback_data=f"stile_select_{key}")] for key, value in data["settings_list"]["style_type"].items()
+                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_style_type"]) else ""), callback_data=f"stile_select_{key}")] for key, value in config.style_type.items()
             ] + [[InlineKeyboardButton(text="💾 Сохранить", callback_data="save")], [InlineKeyboardButton(text="🔙 Назад", callback_data="back")]])
             await state.update_data(state="main")
             await callback.message.edit_text(text="Выберите стиль написания текста:", reply_markup=keyboard_stile_gen)
         elif callback.data == "tone" or data["state"] == "to_tone":
             keyboard_stile_gen = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_tone"]) else ""), callback_data=f"tone_select_{key}")] for key, value in data["settings_list"]["tone"].items()
+                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_tone"]) else ""), callback_data=f"tone_select_{key}")] for key, value in config.tone.items()
             ] + [ [InlineKeyboardButton(text="💾 Сохранить", callback_data="save")],[InlineKeyboardButton(text="🔙 Назад", callback_data="back")]])
             await callback.message.edit_text(text="Выберите тон текста:", reply_markup=keyboard_stile_gen)
             await state.update_data(state="main")
         elif callback.data == "size" or data["state"] == "to_size":
             keyboard_stile_gen = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_size"]) else ""), callback_data=f"size_select_{key}")] for key, value in data["settings_list"]["size"].items()
+                [InlineKeyboardButton(text=f"{value}"+(" 🟢"if str(key) == str(data["settings"]["set_size"]) else ""), callback_data=f"size_select_{key}")] for key, value in config.size.items()
             ] + [[InlineKeyboardButton(text="💾 Сохранить", callback_data="save")], [InlineKeyboardButton(text="🔙 Назад", callback_data="back")]])
             await callback.message.edit_text(text="Выберите примерный размер текста:", reply_markup=keyboard_stile_gen)
             await state.update_data(state="main")
@@ -589,7 +965,7 @@ class TextBot:
                 data["settings"]["set_org_info"] = 1
                 await callback.answer("🟢 ВКЛЮЧЁН учёт информации о вашей организации")
             await state.update_data(settings=data["settings"])
-            self.db.set_user_settings(callback.from_user.id, data["settings"])
+            await self.db.set_user_settings(callback.from_user.id, data["settings"])
             await self.settings(callback.message, state)
 
         elif callback.data == "to_menu":
@@ -600,30 +976,74 @@ class TextBot:
             await self.settings(callback.message, state)
         elif callback.data == "save":
             data = await state.get_data()
-            self.db.set_user_settings(callback.from_user.id, data["settings"])
+            await self.db.set_user_settings(callback.from_user.id, data["settings"])
             await self.settings(callback.message, state)
         return
 
     async def notify_admins_on_startup(self):
         """Уведомить администраторов о запуске бота"""
-        admins = self.db.get_admins_id()
+        admins = await self.db.get_admins_id()
+        # Параллельно, в пределах лимитов Telegram; ошибки отдельных чатов печатает рассылка
+        delivered = await self.sender.broadcast(self.bot, admins, "✅ Бот запущен и готов к работе! /start")
+        print(f"Уведомление о запуске доставлено администраторам: {delivered} из {len(admins)}")
+
+    def create_webhook_app(self) -> web.Application:
+        """
+        aiohttp-приложение для приёма обновлений через вебхук.
+        Telegram сразу получает ответ 200, а обновление обрабатывается в фоне
+        """
+        app = web.Application()
+        SimpleRequestHandler(
+            dispatcher=self.dp,
+            bot=self.bot,
+            handle_in_background=True,
+            secret_token=os.getenv('WEBHOOK_SECRET') or None
+        ).register(app, path=os.getenv('WEBHOOK_PATH', '/webhook'))
+        setup_application(app, self.dp, bot=self.bot)
+        return app
+
+    async def run_webhook(self):
+        """Запуск бота в режиме вебхука (например, за обратным прокси)"""
+        path = os.getenv('WEBHOOK_PATH', '/webhook')
+        public_url = os.getenv('WEBHOOK_URL')
+        if public_url:
+            await self.bot.set_webhook(public_url.rstrip('/') + path,
+                                       secret_token=os.getenv('WEBHOOK_SECRET') or None)
+
+        runner = web.AppRunner(self.create_webhook_app())
+        await runner.setup()
+        site = web.TCPSite(runner, os.getenv('WEBHOOK_HOST', '0.0.0.0'), int(os.getenv('WEBHOOK_PORT', 8080)))
+        await site.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
 
-        for admin_id in admins:
-            try:
-                await self.bot.send_message(
-                    chat_id=admin_id,
-                    text="✅ Бот запущен и готов к работе! /start"
-                )
-            except Exception as e:
-                print(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+    async def close(self):
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await self.jobs.close()
+        await self.ai.close()
+        await self.dp.storage.close()
+        self.db.close()
 
     async def run(self):
         """Запуск бота"""
+        await self.db.migrate()
+        await self.jobs.start()
+        if self.metrics_port:
+            self.metrics_runner = await metrics.start_server(self.metrics_host, int(self.metrics_port))
         # Уведомляем администраторов о запуске
         await self.notify_admins_on_startup()
 
-        # Запускаем поллинг
-        await self.dp.start_polling(self.bot)
+        try:
+            if os.getenv('BOT_MODE', 'polling') == "webhook":
+                await self.run_webhook()
+            else:
+                # Запускаем поллинг
+                await self.dp.start_polling(self.bot)
+        finally:
+            await self.close()
 
 
 async def main():
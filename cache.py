@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по размеру и времени жизни записей.
+    Рассчитан на работу из одного цикла событий, блокировок не использует.
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=MISSING):
+        item = self._data.get(key)
+        if item is not None:
+            expires, value = item
+            if expires > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Неизменяемое содержимое settings.json с индексами по числовым ключам"""
+    style_type: Mapping[int, str]
+    tone: Mapping[int, str]
+    size: Mapping[int, str]
+    questions: Mapping[int, str]
+
+    @property
+    def questions_count(self) -> int:
+        return len(self.questions)
+
+
+def _index(section: dict, name: str, field: str = None) -> Mapping[int, str]:
+    if not isinstance(section, dict) or not section:
+        raise ValueError(f"settings.json: раздел '{name}' пуст или не является объектом")
+    table = {}
+    for key, value in section.items():
+        if not str(key).isdigit():
+            raise ValueError(f"settings.json: ключ '{key}' в разделе '{name}' должен быть числом")
+        if field is not None:
+            if not isinstance(value, dict) or field not in value:
+                raise ValueError(f"settings.json: у элемента '{key}' в разделе '{name}' нет поля '{field}'")
+            value = value[field]
+        table[int(key)] = str(value)
+    return MappingProxyType(dict(sorted(table.items())))
+
+
+def parse_settings(raw: dict) -> Settings:
+    if "settings" not in raw or "questions" not in raw:
+        raise ValueError("settings.json: нужны разделы 'settings' и 'questions'")
+    settings = raw["settings"]
+    for name in ("style_type", "tone", "size"):
+        if name not in settings:
+            raise ValueError(f"settings.json: в 'settings' нет раздела '{name}'")
+    questions = _index(raw["questions"], "questions", "text")
+    if list(questions) != list(range(1, len(questions) + 1)):
+        raise ValueError("settings.json: вопросы должны идти по порядку начиная с 1")
+    return Settings(
+        style_type=_index(settings["style_type"], "style_type"),
+        tone=_index(settings["tone"], "tone"),
+        size=_index(settings["size"], "size"),
+        questions=questions
+    )
+
+
+class Config:
+    """
+    Загружает settings.json один раз.
+    При hot_reload раз в check_interval секунд сверяет mtime файла и перечитывает его при изменении.
+    """
+
+    def __init__(self, path: str, hot_reload: bool = False, check_interval: float = 1):
+        self.path = path
+        self.hot_reload = hot_reload
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime
+        self._checked_at = time.monotonic()
+        self._current = self._load()
+
+    def _load(self) -> Settings:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return parse_settings(json.load(file))
+
+    @property
+    def current(self) -> Settings:
+        if self.hot_reload and time.monotonic() - self._checked_at >= self.check_interval:
+            self._maybe_reload()
+        return self._current
+
+    def _maybe_reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime != self._mtime:
+                    self._current = self._load()
+                    self._mtime = mtime
+            except (OSError, ValueError) as e:
+                # Битый файл не должен ронять бота: остаёмся на последней корректной версии
+                print(f"Не удалось перечитать {self.path}: {e}")
+
+
+load_dotenv()
+CONFIG = Config(
+    path=os.getenv('SETTINGS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')),
+    hot_reload=os.getenv('SETTINGS_HOT_RELOAD', '0') == '1'
+)
@@ -0,0 +1,77 @@
+import asyncio
+import re
+from dataclasses import dataclass
+
+# Формат строки поста, который просим у модели в контент-плане
+PLAN_LINE_FORMAT = "Дата | Тематика | Хештэг | Варианты оформления"
+
+
+@dataclass(frozen=True)
+class PlanEntry:
+    """Один пост из контент-плана"""
+    date: str
+    topic: str
+    hashtag: str
+    design: str
+
+
+def parse_plan(text: str) -> list:
+    """
+    Разбирает строки вида «Дата | Тематика | Хештэг | Оформление» (в том числе markdown-таблицы).
+    Заголовки и разделители таблиц пропускаются
+    """
+    entries = []
+    for line in text.splitlines():
+        line = line.strip().strip("|").strip()
+        if line.count("|") < 2:
+            continue
+        cells = [cell.strip(" *_`") for cell in line.split("|")]
+        if all(re.fullmatch(r":?-{2,}:?", cell) for cell in cells if cell):
+            continue
+        if cells[0].lower().startswith("дата"):
+            continue
+        cells += [""] * (4 - len(cells))
+        date, topic, hashtag = cells[0], cells[1], cells[2]
+        design = " | ".join(cell for cell in cells[3:] if cell)
+        if topic:
+            entries.append(PlanEntry(date, topic, hashtag, design))
+    return entries
+
+
+def post_prompt(entry: PlanEntry) -> str:
+    prompt = f"Напиши пост для публикации {entry.date}. Тема поста: {entry.topic}."
+    if entry.hashtag:
+        prompt += f" Обязательно используй хештэг {entry.hashtag}."
+    if entry.design:
+        prompt += f" Пожелания к оформлению: {entry.design}."
+    return prompt
+
+
+async def expand_plan(ai, entries: list, settings: dict, info: str, concurrency: int = 5) -> list:
+    """
+    Пишет посты по всем пунктам плана параллельно, не больше concurrency запросов одновременно
+    (и в пределах общего лимита запросов LinkAI).
+    Возвращает список (пункт плана, текст поста или None, если пост не удался)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    prefix = ai.prompt_from_settings(settings) if settings else ""
+
+    async def write(entry: PlanEntry):
+        async with semaphore:
+            try:
+                response = await ai.prompt_with_system_context(prefix + post_prompt(entry), info)
+                return entry, response.output_text
+            except Exception as e:
+                print(f"Не удалось написать пост «{entry.topic}»: {e!r}")
+                return entry, None
+
+    return await asyncio.gather(*(write(entry) for entry in entries))
+
+
+def build_document(posts: list) -> bytes:
+    """Собирает готовые посты в один текстовый документ"""
+    parts = []
+    for number, (entry, text) in enumerate(posts, 1):
+        header = f"Пост {number}. {entry.date} — {entry.topic}"
+        parts.append(f"{header}\n{'=' * len(header)}\n{text or 'Не удалось сгенерировать пост.'}")
+    return "\n\n\n".join(parts).encode("utf-8")
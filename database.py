@@ -1,55 +1,76 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import mysql.connector
 from mysql.connector import Error
+from mysql.connector.pooling import MySQLConnectionPool
 from contextlib import contextmanager
 
+import metrics
+import migrations
+import profiling
+from cache import TTLCache
+
 class Database:
-    def __init__(self, config):
+    def __init__(self, config, pool_size: int = 5, health_check: bool = True):
         self.config = config
+        # mysql-connector не создаёт пул больше 32 соединений
+        self.pool_size = max(1, min(pool_size, 32))
+        self.health_check = health_check
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self) -> MySQLConnectionPool:
+        """Пул создаётся при первом запросе, чтобы конструктор не ходил в БД"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = MySQLConnectionPool(
+                        pool_name=f"bot_pool_{id(self)}",
+                        pool_size=self.pool_size,
+                        pool_reset_session=True,
+                        **self.config
+                    )
+        return self._pool
 
     @contextmanager
     def get_connection(self):
         conn = None
         try:
-            conn = mysql.connector.connect(**self.config)
+            conn = self.pool.get_connection()
+            if self.health_check:
+                # Соединение могло быть закрыто сервером по wait_timeout, пока лежало в пуле
+                conn.ping(reconnect=True, attempts=2, delay=0)
             yield conn
         except Error as e:
             print(f"Database error: {e}")
             raise
         finally:
-            if conn and conn.is_connected():
+            if conn:
+                # Для соединения из пула close() возвращает его в пул
                 conn.close()
 
-    def create_users_table(self):
+    def migrate(self) -> list:
+        """Применить недостающие миграции схемы (см. migrations.py); возвращает номера примененных"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    full_name VARCHAR(255),
-                    is_admin BOOLEAN DEFAULT FALSE,
-                    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
+            return migrations.migrate(conn)
 
-    def register_user(self, user_id: int, username: str, full_name: str, is_admin: bool = False):
+    def register_user(self, user_id: int, username: str, full_name: str, is_admin: bool = False) -> bool:
+        """
+        Зарегистрировать пользователя вместе с его организацией, если его ещё нет.
+        Проверка, вставка и создание организации выполняются процедурой register_user за один запрос
+        :return: True, если пользователь создан
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            # Сначала создаем организацию для пользователя
-            cursor.execute("""
-                           INSERT INTO organizations (organization_name, organization_info_data)
-                           VALUES (%s, %s)
-                           """, (f"Организация {full_name}", "Не указано"))
-            # Получаем ID созданной организации
-            organization_id = cursor.lastrowid
-            # Создаем пользователя с привязкой к организации
-            cursor.execute("""
-                           INSERT IGNORE INTO users (user_id, username, full_name, is_admin, organization)
-                            VALUES (%s, %s,%s,%s,%s)
-                           """, (user_id, username, full_name, is_admin, organization_id))
-            conn.commit()
+            cursor.callproc("register_user", (user_id, username, full_name, is_admin))
+            created = False
+            for result in cursor.stored_results():
+                row = result.fetchone()
+                created = bool(row and row[0])
+            return created
 
     def is_admin(self, user_id: int) -> bool:
         with self.get_connection() as conn:
@@ -77,32 +98,22 @@ class Database:
         with self.get_connection() as conn:
             cursor = conn.cursor(dictionary=True)
             cursor.execute("""
-                           SELECT *
+                           SELECT set_org_info, set_style_type, set_size, set_tone
                            FROM users
                            WHERE user_id = %s
                            """, (user_id,))
-            user_data = cursor.fetchone()
+            settings = cursor.fetchone()
 
-            if not user_data:
-                return {}
+            return settings if settings else {}
 
-            # Фильтруем только столбцы, начинающиеся с "set"
-            settings = {}
-            for key, value in user_data.items():
-                if key.startswith('set'):
-                    settings[key] = value
-
-            return settings
     def organization_info_reload(self, user_id: int, new_info: str ):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                            UPDATE organizations 
-                            SET organization_info_data = %s 
-                            WHERE id = (
-                                SELECT organization 
-                                FROM users
-                                WHERE user_id = %s)
+                            UPDATE organizations o
+                            JOIN users u ON o.id = u.organization
+                            SET o.organization_info_data = %s
+                            WHERE u.user_id = %s
                             """,(new_info, user_id))
             conn.commit()
 
@@ -121,12 +132,10 @@ class Database:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                            SELECT organization_info_data, organization_name
-                            FROM organizations
-                            WHERE id = (
-                                SELECT organization
-                                FROM users
-                                WHERE user_id = %s)""",(user_id,))
+                            SELECT o.organization_info_data, o.organization_name
+                            FROM users u
+                            JOIN organizations o ON o.id = u.organization
+                            WHERE u.user_id = %s""",(user_id,))
             result = cursor.fetchone()
             return result
 
@@ -147,4 +156,142 @@ class Database:
                 return cursor.rowcount > 0  # Возвращает True если обновление прошло успешно
         except Exception as e:
             print(f"Ошибка при обновлении настроек пользователя {user_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+    def get_system_prompt(self, user_id: int):
+        """Собранный системный промпт организации пользователя: (system_prompt, system_role, version)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                           SELECT o.system_prompt, o.system_role, o.system_prompt_version
+                           FROM users u
+                           JOIN organizations o ON o.id = u.organization
+                           WHERE u.user_id = %s
+                           """, (user_id,))
+            return cursor.fetchone()
+
+    def save_system_prompt(self, user_id: int, system_prompt: str, system_role: str = None):
+        """Сохранить новую версию системного промпта; system_role=None оставляет прежнюю роль"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                           UPDATE organizations o
+                           JOIN users u ON o.id = u.organization
+                           SET o.system_prompt = %s,
+                               o.system_role = COALESCE(%s, o.system_role),
+                               o.system_prompt_version = o.system_prompt_version + 1
+                           WHERE u.user_id = %s
+                           """, (system_prompt, system_role, user_id))
+            conn.commit()
+            return cursor.rowcount > 0
+
+
+class AsyncDatabase:
+    """
+    Асинхронный доступ к Database для обработчиков бота.
+    Запросы выполняются в пуле потоков размером с пул соединений,
+    поэтому ожидание БД не блокирует цикл событий и не исчерпывает пул.
+    """
+
+    def __init__(self, db: Database, cache_size: int = 10000, cache_ttl: float = 60):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=db.pool_size, thread_name_prefix="db")
+
+        # Кэши по user_id; сбрасываются методами записи
+        self.settings_cache = TTLCache(cache_size, cache_ttl)
+        self.org_info_cache = TTLCache(cache_size, cache_ttl)
+        self.admin_cache = TTLCache(cache_size, cache_ttl)
+        self.system_prompt_cache = TTLCache(cache_size, cache_ttl)
+
+    async def run(self, func, *args, name: str = None):
+        """
+        Выполнить синхронную функцию в пуле потоков БД
+        :param func:
+        :param args:
+        :param name: имя для метрик, по умолчанию имя функции
+        :return:
+        """
+        name = name or func.__name__
+
+        def timed():
+            # Замер внутри потока: ожидание свободного потока не входит во время запроса
+            with metrics.track(metrics.DB_SECONDS, metrics.DB_IN_FLIGHT, metrics.DB_ERRORS, method=name):
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        # Для разбивки времени апдейта считаем и ожидание свободного потока
+        with profiling.span("db"):
+            return await loop.run_in_executor(self._executor, timed)
+
+    async def _cached(self, cache: TTLCache, user_id: int, func):
+        value = cache.get(user_id)
+        if value is TTLCache.MISSING:
+            value = await self.run(func, user_id)
+            cache.set(user_id, value)
+        return value
+
+    def cache_stats(self) -> dict:
+        return {
+            "settings": self.settings_cache.stats(),
+            "org_info": self.org_info_cache.stats(),
+            "admin": self.admin_cache.stats(),
+            "system_prompt": self.system_prompt_cache.stats()
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def migrate(self) -> list:
+        return await self.run(self.db.migrate)
+
+    async def register_user(self, user_id: int, username: str, full_name: str, is_admin: bool = False) -> bool:
+        created = await self.run(self.db.register_user, user_id, username, full_name, is_admin)
+        if created:
+            self.settings_cache.pop(user_id)
+            self.org_info_cache.pop(user_id)
+            self.admin_cache.pop(user_id)
+            self.system_prompt_cache.pop(user_id)
+        return created
+
+    async def is_admin(self, user_id: int) -> bool:
+        return await self._cached(self.admin_cache, user_id, self.db.is_admin)
+
+    async def user_exists(self, user_id: int) -> bool:
+        return await self.run(self.db.user_exists, user_id)
+
+    async def get_admins_id(self):
+        return await self.run(self.db.get_admins_id)
+
+    async def get_user_settings(self, user_id: int) -> dict:
+        # Копия: обработчики меняют словарь настроек у себя в FSM
+        return dict(await self._cached(self.settings_cache, user_id, self.db.get_user_settings))
+
+    async def organization_info_reload(self, user_id: int, new_info: str):
+        result = await self.run(self.db.organization_info_reload, user_id, new_info)
+        # Организация может быть общей у нескольких пользователей, поэтому сбрасываем всё
+        self.org_info_cache.clear()
+        self.system_prompt_cache.clear()
+        return result
+
+    async def add_administrator(self, username: str):
+        result = await self.run(self.db.add_administrator, username)
+        # Запись идёт по username, а кэш по user_id
+        self.admin_cache.clear()
+        return result
+
+    async def get_organization_info(self, user_id: int):
+        return await self._cached(self.org_info_cache, user_id, self.db.get_organization_info)
+
+    async def set_user_settings(self, user_id: int, settings: dict):
+        result = await self.run(self.db.set_user_settings, user_id, settings)
+        self.settings_cache.pop(user_id)
+        return result
+
+    async def get_system_prompt(self, user_id: int):
+        return await self._cached(self.system_prompt_cache, user_id, self.db.get_system_prompt)
+
+    async def save_system_prompt(self, user_id: int, system_prompt: str, system_role: str = None):
+        result = await self.run(self.db.save_system_prompt, user_id, system_prompt, system_role)
+        self.system_prompt_cache.clear()
+        return result
@@ -0,0 +1,163 @@
+import abc
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from database import AsyncDatabase
+
+
+def dumps(value) -> str:
+    """Компактная сериализация значения FSM"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLStorage(BaseStorage, abc.ABC):
+    """
+    Хранилище FSM в SQL-таблицах: состояние в fsm_state, данные — по строке на ключ в fsm_data.
+    Записываются только изменившиеся ключи, поэтому update_data не переписывает всю анкету.
+    """
+
+    PLACEHOLDER = "?"
+    UPSERT_STATE = ""
+    UPSERT_DATA = ""
+
+    def __init__(self, key_builder: KeyBuilder = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    @abc.abstractmethod
+    async def _execute(self, func, *args):
+        """Выполнить func(cursor, *args) в транзакции и вернуть результат"""
+
+    def _sql(self, query: str) -> str:
+        return query.replace("?", self.PLACEHOLDER)
+
+    def _load_data(self, cursor, key: str) -> Dict[str, str]:
+        cursor.execute(self._sql("SELECT field, value FROM fsm_data WHERE storage_key = ?"), (key,))
+        return dict(cursor.fetchall())
+
+    def _write_data(self, cursor, key: str, data: Dict[str, Any], replace: bool) -> Dict[str, Any]:
+        current = self._load_data(cursor, key)
+        encoded = {field: dumps(value) for field, value in data.items()}
+
+        changed = [(key, field, value) for field, value in encoded.items() if current.get(field) != value]
+        if changed:
+            cursor.executemany(self._sql(self.UPSERT_DATA), changed)
+        if replace:
+            removed = [(key, field) for field in current if field not in encoded]
+            if removed:
+                cursor.executemany(self._sql("DELETE FROM fsm_data WHERE storage_key = ? AND field = ?"), removed)
+            return data
+        current.update(encoded)
+        return {field: json.loads(value) for field, value in current.items()}
+
+    def _write_state(self, cursor, key: str, state: Optional[str]):
+        if state is None:
+            cursor.execute(self._sql("DELETE FROM fsm_state WHERE storage_key = ?"), (key,))
+        else:
+            cursor.execute(self._sql(self.UPSERT_STATE), (key, state))
+
+    def _read_state(self, cursor, key: str) -> Optional[str]:
+        cursor.execute(self._sql("SELECT state FROM fsm_state WHERE storage_key = ?"), (key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._execute(self._write_state, self.key_builder.build(key, "state"), state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._execute(self._read_state, self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._execute(self._write_data, self.key_builder.build(key, "data"), data, True)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self._execute(self._load_data, self.key_builder.build(key, "data"))
+        return {field: json.loads(value) for field, value in data.items()}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._execute(self._write_data, self.key_builder.build(key, "data"), data, False)
+
+
+class SQLiteStorage(SQLStorage):
+    """Хранилище FSM в локальном файле SQLite; запросы идут через один поток"""
+
+    CREATE_TABLES = (
+        """CREATE TABLE IF NOT EXISTS fsm_state (
+               storage_key TEXT PRIMARY KEY,
+               state TEXT NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS fsm_data (
+               storage_key TEXT NOT NULL,
+               field TEXT NOT NULL,
+               value TEXT NOT NULL,
+               PRIMARY KEY (storage_key, field)
+           )""",
+    )
+    UPSERT_STATE = """INSERT INTO fsm_state (storage_key, state) VALUES (?, ?)
+                      ON CONFLICT(storage_key) DO UPDATE SET state = excluded.state"""
+    UPSERT_DATA = """INSERT INTO fsm_data (storage_key, field, value) VALUES (?, ?, ?)
+                     ON CONFLICT(storage_key, field) DO UPDATE SET value = excluded.value"""
+
+    def __init__(self, path: str, key_builder: KeyBuilder = None):
+        super().__init__(key_builder)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL позволяет нескольким процессам бота работать с одним файлом
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for query in self.CREATE_TABLES:
+            self._conn.execute(query)
+        self._conn.commit()
+
+    def _transaction(self, func, *args):
+        cursor = self._conn.cursor()
+        try:
+            result = func(cursor, *args)
+            self._conn.commit()
+            return result
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    async def _execute(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._transaction, func, *args)
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+class MySQLStorage(SQLStorage):
+    """Хранилище FSM в таблицах MySQL через пул соединений Database; таблицы создаёт миграция (migrations.py)"""
+
+    PLACEHOLDER = "%s"
+    UPSERT_STATE = """INSERT INTO fsm_state (storage_key, state) VALUES (?, ?)
+                      ON DUPLICATE KEY UPDATE state = VALUES(state)"""
+    UPSERT_DATA = """INSERT INTO fsm_data (storage_key, field, value) VALUES (?, ?, ?)
+                     ON DUPLICATE KEY UPDATE value = VALUES(value)"""
+
+    def __init__(self, db: AsyncDatabase, key_builder: KeyBuilder = None):
+        super().__init__(key_builder)
+        self.db = db
+
+    def _transaction(self, func, *args):
+        with self.db.db.get_connection() as conn:
+            cursor = conn.cursor()
+            result = func(cursor, *args)
+            conn.commit()
+            return result
+
+    async def _execute(self, func, *args):
+        return await self.db.run(self._transaction, func, *args, name=f"fsm{func.__name__}")
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+
+class JobQueue:
+    """
+    Очередь долгих генераций в файле SQLite с пулом воркеров.
+    Хендлер кладёт задачу через enqueue() и сразу отвечает пользователю, воркер выполняет её
+    и сам присылает результат в чат. Взятая задача арендуется на lease секунд и продлевается,
+    пока выполняется; если процесс упал или перезапустился, задачу после окончания аренды возьмёт
+    любой воркер, в том числе другого процесса с тем же файлом. Результат доставляется хотя бы один раз:
+    при падении между отправкой и отметкой о выполнении пользователь получит его повторно
+    """
+
+    CREATE_TABLES = (
+        """CREATE TABLE IF NOT EXISTS jobs (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               kind TEXT NOT NULL,
+               chat_id INTEGER NOT NULL,
+               user_id INTEGER NOT NULL,
+               payload TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'queued',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               run_after REAL NOT NULL,
+               lease_until REAL,
+               owner TEXT,
+               error TEXT,
+               result TEXT,
+               created_at REAL NOT NULL,
+               started_at REAL,
+               finished_at REAL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, run_after)",
+    )
+
+    def __init__(self, path: str, workers: int = 4, max_attempts: int = 2, lease: float = 60,
+                 retry_delay: float = 10, poll_interval: float = 5, retention: float = 7 * 86400):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers = {}
+        self.done = 0
+        self.failed = 0
+        self._running = set()
+        self._tasks = []
+        self._wakeup = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL позволяет нескольким процессам бота работать с одной очередью
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for query in self.CREATE_TABLES:
+            self._conn.execute(query)
+        # Файл очереди мог остаться от версии без результатов задач
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "result" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN result TEXT")
+        self._conn.commit()
+
+    def register(self, kind: str, run, fail=None):
+        """
+        Обработчик задач вида kind
+        :param kind:
+        :param run: async run(job) — выполнить задачу и отправить результат
+        :param fail: async fail(job, error) — сообщить пользователю, что попытки закончились
+        """
+        self.handlers[kind] = (run, fail)
+
+    def _transaction(self, func, *args):
+        cursor = self._conn.cursor()
+        try:
+            result = func(cursor, *args)
+            self._conn.commit()
+            return result
+        except Exception:
+            self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    async def _execute(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._transaction, func, *args)
+
+    def _update_depth(self, cursor) -> int:
+        """Глубина очереди по видам задач для метрик; возвращает общее число ожидающих"""
+        cursor.execute("SELECT kind, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY kind")
+        depth = dict(cursor.fetchall())
+        for kind in set(self.handlers) | set(depth):
+            metrics.JOBS_QUEUED.set(depth.get(kind, 0), kind=kind)
+        return sum(depth.values())
+
+    @staticmethod
+    def _pending(cursor) -> int:
+        cursor.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')")
+        return cursor.fetchone()[0]
+
+    def _insert(self, cursor, kind: str, chat_id: int, user_id: int, payload: str) -> int:
+        now = time.time()
+        cursor.execute("""INSERT INTO jobs (kind, chat_id, user_id, payload, run_after, created_at)
+                          VALUES (?, ?, ?, ?, ?, ?)""", (kind, chat_id, user_id, payload, now, now))
+        return self._update_depth(cursor) - 1
+
+    async def enqueue(self, kind: str, chat_id: int, user_id: int, payload: dict) -> int:
+        """
+        Поставить задачу в очередь
+        :return: сколько задач стоит в очереди перед ней
+        """
+        ahead = await self._execute(self._insert, kind, chat_id, user_id,
+                                    json.dumps(payload, ensure_ascii=False))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return ahead
+
+    def _claim(self, cursor):
+        now = time.time()
+        # Одним UPDATE, чтобы два воркера (или процесса) не взяли одну задачу
+        cursor.execute("""UPDATE jobs
+                          SET status = 'running', attempts = attempts + 1, owner = ?,
+                              lease_until = ?, started_at = ?
+                          WHERE id = (SELECT id FROM jobs
+                                      WHERE (status = 'queued' AND run_after <= ?)
+                                         OR (status = 'running' AND lease_until < ?)
+                                      ORDER BY id LIMIT 1)
+                          RETURNING id, kind, chat_id, user_id, payload, attempts, created_at""",
+                       (self.owner, now + self.lease, now, now, now))
+        row = cursor.fetchone()
+        self._update_depth(cursor)
+        if row is None:
+            return None
+        job_id, kind, chat_id, user_id, payload, attempts, created_at = row
+        return {"id": job_id, "kind": kind, "chat_id": chat_id, "user_id": user_id,
+                "payload": json.loads(payload), "attempts": attempts, "created_at": created_at}
+
+    @staticmethod
+    def _renew(cursor, job_id: int, lease_until: float):
+        cursor.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (lease_until, job_id))
+
+    @staticmethod
+    def _finish(cursor, job_id: int, status: str, error: str = None, run_after: float = None):
+        cursor.execute("""UPDATE jobs
+                          SET status = ?, error = ?, run_after = COALESCE(?, run_after),
+                              lease_until = NULL, finished_at = ?
+                          WHERE id = ?""", (status, error, run_after, time.time(), job_id))
+
+    @staticmethod
+    def _release(cursor, job_ids: list):
+        # Остановка процесса — не ошибка задачи, попытку не засчитываем
+        cursor.executemany("""UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL
+                              WHERE id = ? AND status = 'running'""", [(job_id,) for job_id in job_ids])
+
+    @staticmethod
+    def _set_result(cursor, job_id: int, result: str):
+        cursor.execute("UPDATE jobs SET result = ? WHERE id = ?", (result, job_id))
+
+    @staticmethod
+    def _get_result(cursor, job_id: int, user_id: int):
+        cursor.execute("SELECT result FROM jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    async def set_result(self, job_id: int, result: str):
+        """Сохранить результат задачи, чтобы к нему можно было вернуться, например по кнопке"""
+        await self._execute(self._set_result, job_id, result)
+
+    async def get_result(self, job_id: int, user_id: int):
+        """Результат задачи пользователя или None, если его нет или задача уже удалена по retention"""
+        return await self._execute(self._get_result, job_id, user_id)
+
+    def _cleanup(self, cursor):
+        cursor.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                       (time.time() - self.retention,))
+
+    async def _keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            await self._execute(self._renew, job_id, time.time() + self.lease)
+
+    async def _process(self, job: dict):
+        kind = job["kind"]
+        run, fail = self.handlers.get(kind, (None, None))
+        metrics.JOB_WAIT_SECONDS.observe(time.time() - job["created_at"], kind=kind)
+        if run is None:
+            print(f"Нет обработчика для задачи {job['id']} вида {kind}")
+            await self._execute(self._finish, job["id"], "failed", "no handler")
+            return
+        if job["attempts"] > self.max_attempts:
+            # Аренда истекала уже max_attempts раз: задача, скорее всего, роняет процесс
+            await self._fail(job, fail, RuntimeError("lease expired"))
+            return
+
+        self._running.add(job["id"])
+        keeper = asyncio.create_task(self._keep_lease(job["id"]))
+        error = None
+        try:
+            with metrics.track(metrics.JOB_SECONDS, metrics.JOBS_RUNNING, metrics.JOB_ERRORS, kind=kind):
+                await run(job)
+        except Exception as e:
+            error = e
+        finally:
+            # При остановке процесса задача остаётся в _running, и close() вернёт её в очередь
+            keeper.cancel()
+        self._running.discard(job["id"])
+
+        if error is None:
+            self.done += 1
+            await self._execute(self._finish, job["id"], "done")
+            return
+        print(f"Задача {job['id']} ({kind}), попытка {job['attempts']}: {error!r}")
+        if job["attempts"] < self.max_attempts:
+            await self._execute(self._finish, job["id"], "queued", repr(error),
+                                time.time() + self.retry_delay * job["attempts"])
+            return
+        await self._fail(job, fail, error)
+
+    async def _fail(self, job: dict, fail, error: Exception):
+        self.failed += 1
+        await self._execute(self._finish, job["id"], "failed", repr(error))
+        if fail is not None:
+            try:
+                await fail(job, error)
+            except Exception as e:
+                print(f"Не удалось сообщить об ошибке задачи {job['id']}: {e!r}")
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self._execute(self._claim)
+            except sqlite3.Error as e:
+                print(f"Очередь задач недоступна: {e}")
+                job = None
+            if job is not None:
+                try:
+                    await self._process(job)
+                except Exception as e:
+                    # Например, не удалось записать итог в SQLite: задачу повторит воркер после окончания аренды
+                    self._running.discard(job["id"])
+                    print(f"Ошибка очереди при обработке задачи {job['id']}: {e!r}")
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        """Запустить воркеры; задачи, прерванные прошлым запуском, продолжатся после окончания аренды"""
+        await self._execute(self._cleanup)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def join(self, timeout: float = None):
+        """Дождаться, пока в очереди не останется ожидающих и выполняющихся задач"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while await self._execute(self._pending):
+            if deadline is not None and time.monotonic() > deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(0.1)
+
+    async def close(self):
+        """Остановить воркеры и вернуть незавершённые задачи в очередь для следующего запуска"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            await self._execute(self._release, list(self._running))
+            self._running.clear()
+        self._executor.shutdown(wait=True)
+        self._conn.close()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+
+
+class RequestJournal:
+    """
+    Журнал запросов к модели в формате JSONL.
+    record() только кладёт запись в очередь и не ждёт диска; фоновая задача пишет записи пачками
+    и переименовывает файл в path.1, path.2, ..., когда он вырастает больше max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 ** 2, backups: int = 5,
+                 batch_size: int = 100, flush_interval: float = 1.0, queue_size: int = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue = asyncio.Queue(queue_size)
+        self._task = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, entry: dict):
+        """Добавить запись; если очередь переполнена, запись отбрасывается, а не тормозит хендлер"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._writer())
+        try:
+            self._queue.put_nowait(json.dumps(entry, ensure_ascii=False, default=str))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _writer(self):
+        while True:
+            lines = [await self._queue.get()]
+            # Набираем пачку: всё, что пришло за flush_interval, но не больше batch_size
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(lines) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    lines.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(lines)
+
+    async def _flush(self, lines: list):
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.written += len(lines)
+        except OSError as e:
+            print(f"Не удалось записать журнал запросов {self.path}: {e}")
+        finally:
+            for _ in lines:
+                self._queue.task_done()
+
+    def _write(self, lines: list):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def _rotate(self):
+        for number in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{number}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    async def close(self):
+        """Дописать всё из очереди и остановить фоновую задачу"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+def read_journal(path: str):
+    """Записи журнала по порядку; битые строки (например, оборванные при аварии) пропускаются"""
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
@@ -1,10 +1,76 @@
+import asyncio
+import httpx
 import openai
 from dotenv import load_dotenv
-from yandex_cloud_ml_sdk import YCloudML
+from yandex_cloud_ml_sdk import AsyncYCloudML
 import os
-import json
+import time
 from datetime import date
 
+import metrics
+import profiling
+from config import CONFIG
+from content_batch import PLAN_LINE_FORMAT
+from journal import RequestJournal
+from resilience import CircuitOpenError, Resilience, is_retryable
+from response_cache import ResponseCache
+from routing import DEFAULT_ROUTE, ModelRouter, Route
+from tokens import TokenBudget, parse_budgets
+
+
+class TextStream:
+    """
+    Потоковый ответ модели: при итерации отдаёт новые фрагменты текста.
+    Накопленный текст лежит в text, итоговый объект ответа — в response после завершения.
+    Поток держит место в общем лимите запросов к модели, пока не закрыт: его закрывает конец итерации,
+    а если до итерации дело может не дойти — async with
+    """
+
+    def __init__(self, events, on_finish=None):
+        self._events = events
+        self.text = ""
+        self.response = None
+        self._on_finish = on_finish
+        self._closed = False
+
+    async def close(self):
+        """Закрыть соединение с моделью и освободить место в лимите; повторный вызов ничего не делает"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._events, "close", None) or getattr(self._events, "aclose", None)
+            if close is not None:
+                await close()
+        finally:
+            if self._on_finish is not None:
+                # Вызывается и при обрыве потока, тогда response остаётся None
+                self._on_finish(self.response)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def __aiter__(self):
+        events = self._events.__aiter__()
+        try:
+            while True:
+                # Ожидание очередного события — время модели в разбивке апдейта
+                with profiling.span("llm"):
+                    try:
+                        event = await events.__anext__()
+                    except StopAsyncIteration:
+                        break
+                if event.type == "response.output_text.delta":
+                    self.text += event.delta
+                    yield event.delta
+                elif event.type == "response.completed":
+                    self.response = event.response
+        finally:
+            await self.close()
+
 
 class LinkAI:
     load_dotenv()
@@ -12,23 +78,266 @@ class LinkAI:
     API_KEY = os.getenv('API_KEY')
     CLOUD_FOLDER = os.getenv('CLOUD_FOLDER')
     SIZE = {1: '100', 2: '250', 3: '500'}
-    SETTINGS = json.load(open('settings.json'))['settings']
-    QUESTIONS = json.load(open('settings.json'))['questions']
+    BASE_URL = os.getenv('API_BASE_URL', "https://rest-assistant.api.cloud.yandex.net/v1")
+    # Параметры пула соединений к API
+    MAX_CONNECTIONS = int(os.getenv('API_MAX_CONNECTIONS', 100))
+    MAX_KEEPALIVE = int(os.getenv('API_MAX_KEEPALIVE', 20))
+    KEEPALIVE_EXPIRY = float(os.getenv('API_KEEPALIVE_EXPIRY', 30))
+    TIMEOUT = float(os.getenv('API_TIMEOUT', 60))
+    CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', 5))
+    # Генерация изображений: сколько операций одновременно и как часто опрашивать их статус
+    DRAW_CONCURRENCY = int(os.getenv('DRAW_CONCURRENCY', 10))
+    DRAW_POLL_INTERVAL = float(os.getenv('DRAW_POLL_INTERVAL', 1))
+    DRAW_TIMEOUT = float(os.getenv('DRAW_TIMEOUT', 120))
+    # Кэш ответов для повторяемых правок текста
+    RESPONSE_CACHE_OPERATIONS = [op for op in os.getenv('RESPONSE_CACHE_OPERATIONS', 'upgrade,shorter,easier').split(',') if op]
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 86400))
+    RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH') or None
+    # Повторы и автомат: общий бюджет времени на операцию со всеми попытками, в секундах
+    TIMEOUT_BUDGET = float(os.getenv('LLM_TIMEOUT_BUDGET', 60))
+    TIMEOUT_BUDGETS = {"content_plan": 120, "dialogue": 90, "create_system_prompt": 90}
+    RETRY_ATTEMPTS = int(os.getenv('LLM_RETRY_ATTEMPTS', 4))
+    CIRCUIT_FAILURE_RATIO = float(os.getenv('LLM_CIRCUIT_FAILURE_RATIO', 0.5))
+    CIRCUIT_RESET = float(os.getenv('LLM_CIRCUIT_RESET', 30))
+    # Бюджет входных токенов: общий и по операциям, длинные описания НКО сокращаются до ORG_INFO_TOKEN_LIMIT
+    INPUT_TOKEN_BUDGET = int(os.getenv('LLM_INPUT_TOKEN_BUDGET', 6000))
+    INPUT_TOKEN_BUDGETS = parse_budgets(os.getenv('LLM_INPUT_TOKEN_BUDGETS', 'dialogue:4000,content_plan:4000'))
+    ORG_INFO_TOKEN_LIMIT = int(os.getenv('ORG_INFO_TOKEN_LIMIT', 1000))
+    CHARS_PER_TOKEN = float(os.getenv('LLM_CHARS_PER_TOKEN', 3))
+    LOG_TOKEN_USAGE = os.getenv('LLM_LOG_TOKEN_USAGE', '0') == '1'
+    # Журнал всех запросов к модели (JSONL); пустой путь — журнал выключен
+    JOURNAL_PATH = os.getenv('REQUEST_JOURNAL_PATH') or None
+    JOURNAL_MAX_BYTES = int(os.getenv('REQUEST_JOURNAL_MAX_MB', 50)) * 1024 ** 2
+    JOURNAL_BACKUPS = int(os.getenv('REQUEST_JOURNAL_BACKUPS', 5))
+    # Сколько запросов к модели может выполняться одновременно во всём процессе (по квоте каталога)
+    MAX_IN_FLIGHT = int(os.getenv('LLM_MAX_IN_FLIGHT', 10))
+    # Таблица моделей по операциям; без файла все операции идут в MODEL
+    MODEL_ROUTES_PATH = os.getenv('MODEL_ROUTES_PATH',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models.json'))
+
+    # Правки текста: инструкция и температура. Используются и по одной, и в конвейере улучшений
+    UPGRADE_STEPS = {
+        "upgrade": ("Исправь грамматические, орфографические и пунктуационные ошибки в тексте. Сохраняй исходный порядок слов.", 0.2),
+        "rewrite": ("Перепиши текст другими словами", 0.9),
+        "shorter": ("Перепиши текст короче", 0.6),
+        "easier": ("Перепиши текст проще для понимания", 0.8),
+    }
+
+    # Клиенты, общие для всех экземпляров LinkAI в процессе
+    _clients = {}
+
+    def __init__(self, base_url: str = None, api_key: str = None):
+        self.base_url = base_url or self.BASE_URL
+        self.api_key = api_key or self.API_KEY
+        self.model_uri = f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}"
+        self.router = ModelRouter.from_file(self.MODEL_ROUTES_PATH, self.CLOUD_FOLDER, self.MODEL)
+        self.client = self.shared_client(self.base_url, self.api_key)
+        self._image_model = None
+        self._draw_semaphore = asyncio.Semaphore(self.DRAW_CONCURRENCY)
+        # Каждый вызов модели занимает место, даже если хендлер запускает несколько вызовов параллельно
+        self._llm_semaphore = asyncio.Semaphore(self.MAX_IN_FLIGHT)
+        self.response_cache = ResponseCache(self.RESPONSE_CACHE_OPERATIONS, self.RESPONSE_CACHE_SIZE,
+                                            self.RESPONSE_CACHE_TTL, self.RESPONSE_CACHE_PATH)
+        self.resilience = Resilience(max_attempts=self.RETRY_ATTEMPTS,
+                                     failure_ratio=self.CIRCUIT_FAILURE_RATIO,
+                                     reset_timeout=self.CIRCUIT_RESET)
+        self.tokens = TokenBudget(self.INPUT_TOKEN_BUDGET, self.INPUT_TOKEN_BUDGETS, self.ORG_INFO_TOKEN_LIMIT,
+                                  self.CHARS_PER_TOKEN, log_usage=self.LOG_TOKEN_USAGE)
+        self.journal = None
+        if self.JOURNAL_PATH:
+            self.journal = RequestJournal(self.JOURNAL_PATH, self.JOURNAL_MAX_BYTES, self.JOURNAL_BACKUPS)
+
+    @classmethod
+    def shared_client(cls, base_url: str, api_key: str) -> openai.AsyncOpenAI:
+        '''
+        Один долгоживущий клиент на процесс: соединения и TLS-сессии переиспользуются между запросами
+        :param base_url:
+        :param api_key:
+        :return:
+        '''
+        key = (base_url, api_key)
+        if key not in cls._clients:
+            http_client = openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=cls.MAX_CONNECTIONS,
+                    max_keepalive_connections=cls.MAX_KEEPALIVE,
+                    keepalive_expiry=cls.KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(cls.TIMEOUT, connect=cls.CONNECT_TIMEOUT)
+            )
+            cls._clients[key] = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                project=cls.CLOUD_FOLDER,
+                http_client=http_client,
+                # Повторами занимается Resilience, чтобы они укладывались в бюджет операции
+                max_retries=0
+            )
+        return cls._clients[key]
+
+    @property
+    def image_model(self):
+        '''Модель генерации изображений создаётся один раз и переиспользуется'''
+        if self._image_model is None:
+            sdk = AsyncYCloudML(
+                folder_id=self.CLOUD_FOLDER,
+                auth=self.api_key
+            )
+            self._image_model = sdk.models.image_generation("yandex-art")
+        return self._image_model
+
+    async def close(self):
+        if self.journal is not None:
+            await self.journal.close()
+        self.response_cache.close()
+        client = self._clients.pop((self.base_url, self.api_key), None)
+        if client is not None:
+            await client.close()
+
+    async def _create(self, operation: str, stream: bool = False, **request):
+        '''
+        Единая точка вызова responses.create
+        :param operation: имя операции LinkAI
+        :param stream: вернуть TextStream вместо готового ответа
+        :param request: параметры запроса к модели
+        :return:
+        '''
+        budget = self.TIMEOUT_BUDGETS.get(operation, self.TIMEOUT_BUDGET)
+        request["input"] = self.tokens.fit(operation, request["input"])
+        estimated = self.tokens.estimate(request["input"])
+        route = DEFAULT_ROUTE
+        if self.router is not None:
+            route = self.router.route(operation, estimated)
+            self.router.apply(route, request)
+        if stream:
+            return await self._create_stream(operation, budget, estimated, request, route)
+
+        start = time.perf_counter()
+        cache = self.response_cache.enabled(operation)
+        if cache:
+            key = self.response_cache.key(operation, request["model"], request.get("temperature"), request["input"])
+            response = await self.response_cache.get(key)
+            if response is not None:
+                self._journal(operation, request, start, response, cached=True)
+                return response
+
+        try:
+            async with self._llm_semaphore:
+                with metrics.track(metrics.LLM_SECONDS, metrics.LLM_IN_FLIGHT, metrics.LLM_ERRORS,
+                                   operation=operation), profiling.span("llm"):
+                    response = await self._routed(operation, route, request, budget,
+                                                  lambda: self.client.responses.create(**request))
+        except Exception as e:
+            self._journal(operation, request, start, error=e)
+            raise
+        self._record_usage(operation, response, estimated)
+        self._journal(operation, request, start, response)
+        if cache:
+            await self.response_cache.set(key, response)
+        return response
 
-    def single_prompt(self, prompt):
+    async def _routed(self, operation: str, route: Route, request: dict, budget: float, call):
+        '''
+        Запрос к модели маршрута. Если она недоступна или не ответила за route.timeout,
+        запрос с оставшимся бюджетом уходит в запасную модель (request["model"] меняется на неё)
+        :param operation:
+        :param route:
+        :param request: параметры запроса, которые читает call
+        :param budget: бюджет времени на операцию целиком
+        :param call: корутина-функция без аргументов
+        :return:
+        '''
+        start = time.perf_counter()
+        if route.fallback is None or self.router is None:
+            return await self._call_model(operation, route.model, call, budget)
+        try:
+            return await self._call_model(operation, route.model, call, min(route.timeout or budget, budget))
+        except Exception as e:
+            remaining = budget - (time.perf_counter() - start)
+            # Ошибки в самом запросе (400 и т.п.) запасная модель не исправит
+            if not (is_retryable(e) or isinstance(e, CircuitOpenError)) or remaining <= 0:
+                raise
+            print(f"{operation}: модель {route.model} не ответила ({e!r}), запрос уходит в {route.fallback}")
+            metrics.LLM_FALLBACKS.inc(operation=operation, model=route.model)
+        request["model"] = self.router.uri(route.fallback)
+        return await self._call_model(operation, route.fallback, call, remaining)
+
+    async def _call_model(self, operation: str, model: str, call, budget: float):
+        '''Запрос к одной модели с повторами; у каждой модели свой автомат и своя гистограмма задержек'''
+        with metrics.track(metrics.LLM_MODEL_SECONDS, metrics.LLM_MODEL_IN_FLIGHT, metrics.LLM_MODEL_ERRORS,
+                           model=model):
+            return await self.resilience.call(f"llm:{model}", operation, call, budget)
+
+    def _journal(self, operation: str, request: dict, start: float, response=None, error=None,
+                 stream: bool = False, cached: bool = False):
+        '''Запись о запросе в журнал: параметры запроса, время, токены и id ответа'''
+        if self.journal is None:
+            return
+        usage = getattr(response, "usage", None)
+        self.journal.record({
+            "ts": time.time(),
+            "operation": operation,
+            "stream": stream,
+            "request": request,
+            "latency": round(time.perf_counter() - start, 4),
+            "status": "error" if error is not None else "ok",
+            "error": repr(error) if isinstance(error, BaseException) else error,
+            "cached": cached,
+            "response_id": getattr(response, "id", None),
+            "input_tokens": getattr(usage, "input_tokens", None),
+            "output_tokens": getattr(usage, "output_tokens", None),
+        })
+
+    def _record_usage(self, operation: str, response, estimated: int):
+        self.tokens.record(operation, response, estimated)
+        metrics.record_usage(operation, response)
+
+    async def _create_stream(self, operation: str, budget: float, estimated: int, request: dict,
+                             route: Route = DEFAULT_ROUTE) -> TextStream:
+        '''
+        Потоковый запрос; в метрики попадает время до последнего фрагмента ответа.
+        На запасную модель переходим, только пока поток не открыт.
+        Место в общем лимите запросов занято, пока поток не дочитан или не закрыт (TextStream.close)
+        '''
+        await self._llm_semaphore.acquire()
+        start = time.perf_counter()
+        metrics.LLM_IN_FLIGHT.inc(operation=operation)
+        try:
+            with profiling.span("llm"):
+                events = await self._routed(operation, route, request, budget,
+                                            lambda: self.client.responses.create(stream=True, **request))
+        except BaseException as e:
+            # В том числе отмена: иначе место в лимите не вернётся
+            self._llm_semaphore.release()
+            metrics.LLM_ERRORS.inc(operation=operation)
+            metrics.LLM_SECONDS.observe(time.perf_counter() - start, operation=operation)
+            metrics.LLM_IN_FLIGHT.dec(operation=operation)
+            self._journal(operation, request, start, error=e, stream=True)
+            raise
+
+        def on_finish(response):
+            self._llm_semaphore.release()
+            metrics.LLM_SECONDS.observe(time.perf_counter() - start, operation=operation)
+            metrics.LLM_IN_FLIGHT.dec(operation=operation)
+            if response is None:
+                metrics.LLM_ERRORS.inc(operation=operation)
+                self._journal(operation, request, start, error="stream interrupted", stream=True)
+            else:
+                self._record_usage(operation, response, estimated)
+                self._journal(operation, request, start, response, stream=True)
+
+        return TextStream(events, on_finish)
+
+    async def single_prompt(self, prompt):
         '''
         Только промт
         :param prompt:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "single_prompt",
+            model=self.model_uri,
             input=prompt,
             temperature=0.8,
             max_output_tokens=1500
@@ -36,49 +345,43 @@ class LinkAI:
 
         return response
 
-    def prompt_with_user_context(self, prompt, context):
+    async def prompt_with_user_context(self, prompt, context, stream: bool = False):
         '''
-        Промпт в диалоге
+        Промпт в диалоге: отправляется только новая реплика, история берётся по id предыдущего ответа
         :param prompt:
-        :param context:
+        :param context: id предыдущего ответа (previous_response_id)
+        :param stream:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "prompt_with_user_context",
+            stream=stream,
+            model=self.model_uri,
             input=[{"role": "user", "content": prompt}],
             previous_response_id=context
         )
 
         return response
 
-    def prompt_with_system_context(self, prompt, context):
+    async def prompt_with_system_context(self, prompt, context, stream: bool = False):
         '''
         Промпт и информация об НКО
         :param prompt:
         :param context:
+        :param stream:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "prompt_with_system_context",
+            stream=stream,
+            model=self.model_uri,
             input=[{"role": "system", "content": context + f"Сегодня: {date.today()}"},
                    {"role": "user", "content": prompt}],
         )
 
         return response
 
-    def prompt(self, prompt, context, system):
+    async def prompt(self, prompt, context, system):
         '''
         Промпт с информацией об НКО и контекстом диалоаг
         :param prompt:
@@ -86,14 +389,9 @@ class LinkAI:
         :param system:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "prompt",
+            model=self.model_uri,
             input=[{"role": "system", "content": system + f"Сегодня: {date.today()}"},
                    {"role": "user", "content": prompt}],
             previous_response_id=context
@@ -103,134 +401,161 @@ class LinkAI:
 
     async def draw(self, prompt):
         '''
-        Делает картинки по текстомову запросу
+        Делает картинки по текстомову запросу.
+        Статус отложенной операции опрашивается асинхронно, число одновременных генераций ограничено
         :param prompt:
-        :return:
+        :return: результат с байтами картинки в image_bytes
         '''
-        sdk = YCloudML(
-            folder_id=self.CLOUD_FOLDER,
-            auth=self.API_KEY
-        )
-        model = sdk.models.image_generation("yandex-art")
-
-        operation = model.run_deferred(prompt)
-        result = operation.wait()
+        async def render():
+            operation = await self.image_model.run_deferred(prompt)
+            return await operation.wait(timeout=self.DRAW_TIMEOUT, poll_interval=self.DRAW_POLL_INTERVAL)
+
+        start = time.perf_counter()
+        async with self._draw_semaphore:
+            try:
+                with metrics.track(metrics.LLM_SECONDS, metrics.LLM_IN_FLIGHT, metrics.LLM_ERRORS, operation="draw"), \
+                        profiling.span("llm"):
+                    result = await self.resilience.call("art", "draw", render, self.DRAW_TIMEOUT)
+            except Exception as e:
+                self._journal("draw", {"prompt": prompt}, start, error=e)
+                raise
+        self._journal("draw", {"prompt": prompt}, start)
 
         return result
 
-    def upgrade(self, prompt):
+    async def upgrade(self, prompt):
         '''
         Исправление ошибок в тексте
         :param prompt:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "upgrade",
+            model=self.model_uri,
             input=[{
                 "role": "system",
-                "content": "Исправь грамматические, орфографические и пунктуационные ошибки в тексте. Сохраняй исходный порядок слов."
+                "content": self.UPGRADE_STEPS["upgrade"][0]
             }, {"role": "user", "content": prompt}],
-            temperature=0.2,
+            temperature=self.UPGRADE_STEPS["upgrade"][1],
             max_output_tokens=1500
         )
 
         return response
 
 
-    def rewrite(self, prompt):
+    async def rewrite(self, prompt):
         '''
         Переписывает текст другими словами
         :param prompt:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "rewrite",
+            model=self.model_uri,
             input=[{
                 "role": "system",
-                "content": "Перепиши текст другими словами"
+                "content": self.UPGRADE_STEPS["rewrite"][0]
             }, {"role": "user", "content": prompt}],
-            temperature=0.9,
+            temperature=self.UPGRADE_STEPS["rewrite"][1],
             max_output_tokens=1500
         )
 
         return response
 
 
-    def shorter(self, prompt):
+    async def shorter(self, prompt):
         '''
         Сокращает текст
         :param prompt:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "shorter",
+            model=self.model_uri,
             input=[{
                 "role": "system",
-                "content": "Перепиши текст короче"
+                "content": self.UPGRADE_STEPS["shorter"][0]
             }, {"role": "user", "content": prompt}],
-            temperature=0.6,
+            temperature=self.UPGRADE_STEPS["shorter"][1],
             max_output_tokens=1500
         )
 
         return response
 
 
-    def easier(self, prompt):
+    async def easier(self, prompt):
         '''
         Пересказывает текст проще
         :param prompt:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
+        response = await self._create(
+            "easier",
+            model=self.model_uri,
+            input=[{
+                "role": "system",
+                "content": self.UPGRADE_STEPS["easier"][0]
+            }, {"role": "user", "content": prompt}],
+            temperature=self.UPGRADE_STEPS["easier"][1],
+            max_output_tokens=1500
         )
 
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        return response
+
+    async def upgrade_pipeline(self, prompt, steps: list):
+        '''
+        Несколько правок текста одной генерацией: инструкции шагов собираются в одну по порядку
+        :param prompt:
+        :param steps: имена правок из UPGRADE_STEPS
+        :return:
+        '''
+        if len(steps) == 1:
+            return await getattr(self, steps[0])(prompt)
+        instructions = "\n".join(f"{number}. {self.UPGRADE_STEPS[step][0]}" for number, step in enumerate(steps, 1))
+        response = await self._create(
+            "upgrade_pipeline",
+            model=self.model_uri,
             input=[{
                 "role": "system",
-                "content": "Перепиши текст проще для понимания"
+                "content": "Выполни с текстом по порядку все шаги и верни только итоговый текст, без пояснений:\n"
+                           + instructions
             }, {"role": "user", "content": prompt}],
-            temperature=0.8,
+            # Самая осторожная температура из шагов, чтобы не потерять смысл и исправления
+            temperature=min(self.UPGRADE_STEPS[step][1] for step in steps),
             max_output_tokens=1500
         )
 
         return response
 
-    def content_plan(self, prompt, info):
+    async def upgrade_variants(self, prompt, steps: list) -> list:
+        '''
+        Независимые правки одного текста параллельно; каждая правка занимает своё место в общем лимите запросов
+        :param prompt:
+        :param steps: имена правок из UPGRADE_STEPS
+        :return: список (правка, текст или None, если правка не удалась)
+        '''
+        responses = await asyncio.gather(*(getattr(self, step)(prompt) for step in steps), return_exceptions=True)
+        variants = []
+        for step, response in zip(steps, responses):
+            if isinstance(response, Exception):
+                print(f"Не удалось выполнить правку {step}: {response!r}")
+                variants.append((step, None))
+            else:
+                variants.append((step, response.output_text))
+        return variants
+
+    async def content_plan(self, prompt, info, stream: bool = False):
         '''
         Контент план
         :param prompt:
+        :param stream:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
-
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        info = await self.compact_info(info)
+        response = await self._create(
+            "content_plan",
+            stream=stream,
+            model=self.model_uri,
             input=[{
                 "role": "system",
                 "content": f"""
@@ -238,6 +563,7 @@ class LinkAI:
 на период [указать временной промежуток, например, месяц] с учётом следующих параметров:   
 1. Укажи дни когда нужно сделать пост, учитывая частоту, если указана, и важные события
 2. Для каждого поста в плане укажи его тематику, хештэг к нему, варианты для его оформления.
+3. Каждый пост запиши отдельной строкой в формате: {PLAN_LINE_FORMAT}
 Опирайся на информацию ниже ㅤ{info}""" + f"Сегодня: {date.today()}"
 
             }, {"role": "user", "content": prompt}],
@@ -246,20 +572,36 @@ class LinkAI:
 
         return response
 
-    def create_system_prompt(self, prompt):
+    async def structure_plan(self, plan):
         '''
-        Функция для собирания информации об организации в системный промт
-        :param prompt:
+        Переписывает контент-план в строки «Дата | Тематика | Хештэг | Оформление» для пакетной генерации постов
+        :param plan:
         :return:
         '''
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
+        response = await self._create(
+            "structure_plan",
+            model=self.model_uri,
+            input=[{
+                "role": "system",
+                "content": f"""Перепиши контент-план: каждый пост отдельной строкой в формате {PLAN_LINE_FORMAT}.
+Ничего не добавляй и не пропускай, не пиши пояснений и заголовков."""
+            }, {"role": "user", "content": plan}],
+            temperature=0.1,
+            max_output_tokens=3000
         )
 
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        return response
+
+    async def create_system_prompt(self, prompt):
+        '''
+        Функция для собирания информации об организации в системный промт
+        :param prompt:
+        :return:
+        '''
+        prompt = await self.compact_info(prompt)
+        response = await self._create(
+            "create_system_prompt",
+            model=self.model_uri,
             input=[{
                 "role": "system",
                 "content": """
@@ -277,28 +619,58 @@ class LinkAI:
 
         return response
 
+    async def summarize_info(self, info, max_tokens: int):
+        '''
+        Сокращает описание организации, сохраняя факты, контакты и хештэги
+        :param info:
+        :param max_tokens:
+        :return:
+        '''
+        response = await self._create(
+            "summarize_info",
+            model=self.model_uri,
+            input=[{
+                "role": "system",
+                "content": "Сократи описание Не Коммерческой Организации. Сохрани название, чем она занимается, "
+                           "фактические данные, контакты и все хештэги. Не добавляй ничего от себя."
+            }, {"role": "user", "content": info}],
+            temperature=0.1,
+            max_output_tokens=max_tokens
+        )
+
+        return response
+
+    async def compact_info(self, info: str) -> str:
+        '''
+        Описание организации, уложенное в ORG_INFO_TOKEN_LIMIT токенов.
+        Длинное описание сокращается моделью один раз, дальше берётся из кэша
+        :param info:
+        :return:
+        '''
+        return await self.tokens.compact(info, self.summarize_info)
+
     def prompt_from_settings(self, settings: dict) -> str:
-        style = self.SETTINGS['style_type'][str(settings['set_style_type'])]
-        tone = self.SETTINGS['tone'][str(settings['set_tone'])]
-        size = self.SETTINGS['size'][str(settings['set_size'])]
+        config = CONFIG.current
+        style = config.style_type[int(settings['set_style_type'])]
+        tone = config.tone[int(settings['set_tone'])]
+        size = config.size[int(settings['set_size'])]
         return f"Пиши в стиле:{style}, в тоне: {tone}, около {size} слов. Не уточняй по поводу вышеперечисленных пунктов и сконцентрируйся на вводе пользователя. Далее следует информация об организации."
 
-    def dialogue(self, answers: dict, org_info: str):
-        client = openai.OpenAI(
-            api_key=self.API_KEY,
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            project=self.CLOUD_FOLDER
-        )
+    async def dialogue(self, answers: dict, org_info: str, stream: bool = False):
+        org_info = await self.compact_info(org_info)
         messages = [{"role": "system", "content": f"""
 Ты опытный SMM специалист, ты помогаешь Не Коммерческой Организации сделать пост в их социальных сетях. 
 Для получения информации ты сначала проводишь опрос, потом предлагешь текст поста. 
 Ответы уже получены. Старайся не ссылаться на примеры в заданных тобой вопросах. 
 Используй хештэги указанные пользователем и подходящие из описания НКО, указанного ниже.{org_info}""" + f"Сегодня: {date.today()}"}]
+        questions = CONFIG.current.questions
         for key, value in answers.items():
-            messages.append({"role": "assistant", "content": self.QUESTIONS[key]["text"]})
+            messages.append({"role": "assistant", "content": questions[int(key)]})
             messages.append({"role": "user", "content": value})
-        response = client.responses.create(
-            model=f"gpt://{self.CLOUD_FOLDER}/{self.MODEL}",
+        response = await self._create(
+            "dialogue",
+            stream=stream,
+            model=self.model_uri,
             input=messages,
             temperature=0.8
         )
@@ -306,10 +678,15 @@ class LinkAI:
         return response
 
 
-if __name__ == "__main__":
+async def main():
     ai = LinkAI()
-    resp = ai.draw("Чёрный кот с большими красными глазами")
-    # resp = ai.single_prompt(
+    resp = await ai.draw("Чёрный кот с большими красными глазами")
+    # resp = await ai.single_prompt(
     #    "Ты делаешь ИИ чат бота для помощи НКО в создании контента для соцсетей. Придумай список уточняющих вопросов, на которые должен ответить человек, чтобы бот смог сделать пост наиболее релевантым и живым")
-    # resp = ai.create_system_prompt("НКО занимается помощью людям без определенного места жительства. Называется 'Ночлежка', работает в Москве")
+    # resp = await ai.create_system_prompt("НКО занимается помощью людям без определенного места жительства. Называется 'Ночлежка', работает в Москве")
     print(resp)
+    await ai.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,227 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Границы корзин гистограмм задержек, в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """Метрика с метками; обновляется и из потоков пула БД, поэтому под блокировкой"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        """Сумма по всем меткам"""
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                # [число наблюдений в каждой корзине, сумма, общее число]
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            item = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    item[0][i] += 1
+            item[1] += value
+            item[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self._header()
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {bucket}")
+            lines.append(f'{self.name}_bucket{_labels(names, key + ("+Inf",))} {count}')
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса и функций, снимающих значения в момент запроса /metrics"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = ()) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames))
+
+    def add_collector(self, func):
+        """func() вызывается перед выдачей метрик, чтобы обновить gauge из внешних счётчиков"""
+        self.collectors.append(func)
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Не удалось собрать метрики: {e!r}")
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+HANDLER_IN_FLIGHT = REGISTRY.gauge("bot_handler_in_flight", "Апдейты в обработке", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Ошибки в хендлерах", ("handler",))
+
+LLM_SECONDS = REGISTRY.histogram("llm_request_seconds", "Время запроса к модели, с повторами", ("operation",))
+LLM_IN_FLIGHT = REGISTRY.gauge("llm_in_flight", "Запросы к модели в процессе", ("operation",))
+LLM_ERRORS = REGISTRY.counter("llm_errors_total", "Запросы к модели, завершившиеся ошибкой", ("operation",))
+LLM_MODEL_SECONDS = REGISTRY.histogram("llm_model_seconds",
+                                       "Время ответа модели с повторами (для потока — до его начала)", ("model",))
+LLM_MODEL_IN_FLIGHT = REGISTRY.gauge("llm_model_in_flight", "Запросы к модели в процессе", ("model",))
+LLM_MODEL_ERRORS = REGISTRY.counter("llm_model_errors_total", "Запросы к модели, завершившиеся ошибкой", ("model",))
+LLM_FALLBACKS = REGISTRY.counter("llm_fallbacks_total", "Переходы на запасную модель", ("operation", "model"))
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Токены по response.usage", ("operation", "direction"))
+RESILIENCE_RETRIES = REGISTRY.counter("resilience_retries_total", "Повторы после временных ошибок", ("operation",))
+RESILIENCE_FAILURES = REGISTRY.counter("resilience_failures_total",
+                                       "Временные ошибки (429, 5xx, таймауты), включая повторённые", ("operation",))
+RESILIENCE_REJECTED = REGISTRY.counter("resilience_rejected_total", "Запросы, отклонённые разомкнутым автоматом",
+                                       ("operation",))
+CIRCUIT_OPENED = REGISTRY.counter("circuit_opened_total", "Размыкания автомата сервиса", ("service",))
+CIRCUIT_STATE = REGISTRY.gauge("circuit_state", "Состояние автомата: 0 — замкнут, 1 — пробный запрос, 2 — разомкнут",
+                               ("service",))
+
+DB_SECONDS = REGISTRY.histogram("db_query_seconds", "Время выполнения метода Database", ("method",))
+DB_IN_FLIGHT = REGISTRY.gauge("db_in_flight", "Выполняющиеся методы Database", ("method",))
+DB_ERRORS = REGISTRY.counter("db_errors_total", "Ошибки в методах Database", ("method",))
+
+SCHEDULER_IN_FLIGHT = REGISTRY.gauge("llm_scheduler_in_flight", "Занятые слоты планировщика запросов к модели")
+SCHEDULER_QUEUED = REGISTRY.gauge("llm_scheduler_queued", "Запросы, ожидающие слота планировщика")
+CACHE_HIT_RATE = REGISTRY.gauge("cache_hit_rate", "Доля попаданий в кэш", ("cache",))
+
+JOBS_QUEUED = REGISTRY.gauge("jobs_queued", "Фоновые задачи, ожидающие воркера", ("kind",))
+JOBS_RUNNING = REGISTRY.gauge("jobs_running", "Фоновые задачи в работе у воркеров процесса", ("kind",))
+JOB_WAIT_SECONDS = REGISTRY.histogram("job_wait_seconds", "Время от постановки задачи до начала попытки", ("kind",))
+JOB_SECONDS = REGISTRY.histogram("job_seconds", "Время выполнения попытки фоновой задачи", ("kind",))
+JOB_ERRORS = REGISTRY.counter("job_errors_total", "Попытки фоновых задач, завершившиеся ошибкой", ("kind",))
+
+TELEGRAM_THROTTLE_SECONDS = REGISTRY.histogram("telegram_throttle_seconds",
+                                               "Ожидание лимитов Telegram перед отправкой сообщения")
+TELEGRAM_RETRY_AFTER = REGISTRY.counter("telegram_retry_after_total", "Повторы отправки после ответа 429 от Telegram")
+
+
+@contextmanager
+def track(histogram: Histogram, in_flight: Gauge, errors: Counter, **labels):
+    """Замерить блок кода: время в histogram, выполняющиеся в in_flight, исключения в errors"""
+    in_flight.inc(**labels)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+        in_flight.dec(**labels)
+
+
+def record_usage(operation: str, response):
+    """Учесть токены из response.usage"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "input_tokens", None) or 0, operation=operation, direction="input")
+    LLM_TOKENS.inc(getattr(usage, "output_tokens", None) or 0, operation=operation, direction="output")
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_server(host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    """Поднимает HTTP-сервер с /metrics рядом с ботом"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def handler_middleware(handler, event, data: dict):
+    """Внутренний middleware aiogram: замер каждого хендлера бота по имени его метода"""
+    callback = getattr(data.get("handler"), "callback", None)
+    name = getattr(callback, "__name__", "unknown")
+    with track(HANDLER_SECONDS, HANDLER_IN_FLIGHT, HANDLER_ERRORS, handler=name):
+        return await handler(event, data)
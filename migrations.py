@@ -0,0 +1,231 @@
+"""
+Версионированные миграции схемы MySQL.
+Каждая миграция применяется один раз, номер примененной записывается в schema_migrations.
+Миграции написаны так, чтобы их можно было применить и к пустой БД, и к уже работающей
+(столбцы, индексы и ключи добавляются, только если их ещё нет).
+"""
+
+LOCK_NAME = "bot_schema_migrations"
+
+
+def _columns(cursor, table: str) -> set:
+    cursor.execute("""
+                   SELECT COLUMN_NAME
+                   FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                   """, (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _indexes(cursor, table: str) -> set:
+    cursor.execute("""
+                   SELECT DISTINCT INDEX_NAME
+                   FROM information_schema.STATISTICS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                   """, (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _foreign_keys(cursor, table: str) -> set:
+    cursor.execute("""
+                   SELECT CONSTRAINT_NAME
+                   FROM information_schema.TABLE_CONSTRAINTS
+                   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+                   """, (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _add_columns(cursor, table: str, columns: dict):
+    existing = _columns(cursor, table)
+    for name, definition in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _add_indexes(cursor, table: str, indexes: dict):
+    existing = _indexes(cursor, table)
+    for name, columns in indexes.items():
+        if name not in existing:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+
+
+def baseline(cursor):
+    """Таблицы organizations и users со всеми столбцами, которые использует бот"""
+    cursor.execute("""
+                   CREATE TABLE IF NOT EXISTS organizations (
+                       id INT AUTO_INCREMENT PRIMARY KEY,
+                       organization_name VARCHAR(255),
+                       organization_info_data TEXT
+                   )
+                   """)
+    cursor.execute("""
+                   CREATE TABLE IF NOT EXISTS users (
+                       id INT AUTO_INCREMENT PRIMARY KEY,
+                       user_id BIGINT UNIQUE NOT NULL,
+                       username VARCHAR(255),
+                       full_name VARCHAR(255),
+                       is_admin BOOLEAN DEFAULT FALSE,
+                       registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                   )
+                   """)
+    # Таблицы могли быть созданы раньше вручную или старым create_users_table без этих столбцов
+    _add_columns(cursor, "organizations", {
+        "organization_name": "VARCHAR(255)",
+        "organization_info_data": "TEXT",
+    })
+    _add_columns(cursor, "users", {
+        "organization": "INT NULL",
+        "set_org_info": "TINYINT NOT NULL DEFAULT 1",
+        "set_style_type": "INT NOT NULL DEFAULT 1",
+        "set_size": "INT NOT NULL DEFAULT 1",
+        "set_tone": "INT NOT NULL DEFAULT 1",
+    })
+
+
+def system_prompt(cursor):
+    """Собранный системный промпт организации"""
+    _add_columns(cursor, "organizations", {
+        "system_role": "TEXT NULL",
+        "system_prompt": "TEXT NULL",
+        "system_prompt_version": "INT NOT NULL DEFAULT 0",
+    })
+
+
+def indexes(cursor):
+    """Индексы для поиска администратора по username, списка администраторов и связи с организацией"""
+    _add_indexes(cursor, "users", {
+        "idx_users_username": "username",
+        "idx_users_is_admin": "is_admin",
+        "idx_users_organization": "organization",
+    })
+
+
+def organizations_fk(cursor):
+    """Удаление организаций-сирот, оставленных прежней регистрацией, и внешний ключ users.organization"""
+    cursor.execute("""
+                   UPDATE users u
+                   LEFT JOIN organizations o ON o.id = u.organization
+                   SET u.organization = NULL
+                   WHERE u.organization IS NOT NULL AND o.id IS NULL
+                   """)
+    cursor.execute("""
+                   DELETE o
+                   FROM organizations o
+                   LEFT JOIN users u ON u.organization = o.id
+                   WHERE u.id IS NULL
+                   """)
+    if "fk_users_organization" not in _foreign_keys(cursor, "users"):
+        cursor.execute("""
+                       ALTER TABLE users
+                       ADD CONSTRAINT fk_users_organization
+                       FOREIGN KEY (organization) REFERENCES organizations (id) ON DELETE SET NULL
+                       """)
+
+
+def register_procedure(cursor):
+    """
+    Процедура get-or-create пользователя: одна транзакция и один запрос от бота.
+    Организация создаётся только для нового пользователя, поэтому сирот больше не бывает
+    """
+    cursor.execute("DROP PROCEDURE IF EXISTS register_user")
+    cursor.execute("""
+                   CREATE PROCEDURE register_user(IN p_user_id BIGINT, IN p_username VARCHAR(255),
+                                                  IN p_full_name VARCHAR(255), IN p_is_admin BOOLEAN)
+                   BEGIN
+                       DECLARE created INT DEFAULT 0;
+                       START TRANSACTION;
+                       -- Уникальный user_id: при одновременных /start пользователя создаст только один запрос
+                       INSERT IGNORE INTO users (user_id, username, full_name, is_admin)
+                       VALUES (p_user_id, p_username, p_full_name, p_is_admin);
+                       SET created = ROW_COUNT();
+                       IF created = 1 THEN
+                           INSERT INTO organizations (organization_name, organization_info_data)
+                           VALUES (CONCAT('Организация ', p_full_name), 'Не указано');
+                           UPDATE users SET organization = LAST_INSERT_ID() WHERE user_id = p_user_id;
+                       END IF;
+                       COMMIT;
+                       SELECT created;
+                   END
+                   """)
+
+
+def organization_prompt(cursor):
+    """
+    В organizations остаётся только промпт организации: прежде туда попадали настройки последнего
+    сохранившего их пользователя, а для организаций без описания — роль, придуманная моделью по «Не указано»
+    """
+    cursor.execute("""
+                   UPDATE organizations
+                   SET system_role = NULL, system_prompt = NULL
+                   WHERE organization_info_data IS NULL OR organization_info_data = 'Не указано'
+                   """)
+    cursor.execute("""
+                   UPDATE organizations
+                   SET system_prompt = CONCAT(system_role, 'Используй при создании постов хештэги.')
+                   WHERE system_role IS NOT NULL
+                   """)
+
+def fsm_tables(cursor):
+    """Таблицы хранилища состояний диалогов (FSM_STORAGE=mysql)"""
+    cursor.execute("""
+                   CREATE TABLE IF NOT EXISTS fsm_state (
+                       storage_key VARCHAR(255) PRIMARY KEY,
+                       state VARCHAR(255) NOT NULL
+                   )
+                   """)
+    cursor.execute("""
+                   CREATE TABLE IF NOT EXISTS fsm_data (
+                       storage_key VARCHAR(255) NOT NULL,
+                       field VARCHAR(100) NOT NULL,
+                       value MEDIUMTEXT NOT NULL,
+                       PRIMARY KEY (storage_key, field)
+                   )
+                   """)
+
+MIGRATIONS = [
+    (1, "Базовая схема users и organizations", baseline),
+    (2, "Системный промпт организации", system_prompt),
+    (3, "Индексы users", indexes),
+    (4, "Организации-сироты и внешний ключ users.organization", organizations_fk),
+    (5, "Процедура регистрации register_user", register_procedure),
+    (6, "Промпт организации без настроек пользователей", organization_prompt),
+    (7, "Таблицы состояний диалогов", fsm_tables),
+]
+
+
+def migrate(conn) -> list:
+    """
+    Применить недостающие миграции по порядку
+    :param conn: соединение MySQL
+    :return: номера применённых миграций
+    """
+    cursor = conn.cursor()
+    # Несколько процессов бота могут стартовать одновременно: миграции применяет только один
+    cursor.execute("SELECT GET_LOCK(%s, 60)", (LOCK_NAME,))
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("Не удалось дождаться блокировки миграций")
+    try:
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS schema_migrations (
+                           version INT PRIMARY KEY,
+                           description VARCHAR(255) NOT NULL,
+                           applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                       )
+                       """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+        applied = []
+        for version, description, apply in MIGRATIONS:
+            if version in done:
+                continue
+            # DDL в MySQL фиксируется сразу, поэтому каждая миграция повторяема сама по себе
+            apply(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                           (version, description))
+            conn.commit()
+            applied.append(version)
+            print(f"Применена миграция {version}: {description}")
+        return applied
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
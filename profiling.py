@@ -0,0 +1,113 @@
+import asyncio
+import contextvars
+import cProfile
+import os
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Разбивка времени текущего апдейта по видам ожидания; задачи, созданные хендлером, пишут в тот же словарь
+_update = contextvars.ContextVar("profiling_update", default=None)
+
+KINDS = ("db", "llm", "telegram")
+
+
+def add(kind: str, seconds: float):
+    """Учесть время kind (db, llm, telegram) в разбивке текущего апдейта"""
+    update = _update.get()
+    if update is not None:
+        update["times"][kind] += seconds
+
+
+@contextmanager
+def span(kind: str):
+    """Замерить блок кода как время kind текущего апдейта"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(kind, time.perf_counter() - start)
+
+
+async def telegram_middleware(make_request, bot, method):
+    """Middleware сессии aiogram: время вызовов Bot API"""
+    with span("telegram"):
+        return await make_request(bot, method)
+
+
+async def handler_middleware(handler, event, data: dict):
+    """Внутренний middleware: запоминает имя хендлера и состояние FSM, в котором пришёл апдейт"""
+    update = _update.get()
+    if update is not None:
+        update["handler"] = getattr(getattr(data.get("handler"), "callback", None), "__name__", None)
+        update["state"] = data.get("raw_state")
+    return await handler(event, data)
+
+
+class ProfilingMiddleware:
+    """
+    Внешний middleware апдейтов: полное время обработки с разбивкой на БД, модель и Telegram
+    (время параллельных запросов одного апдейта суммируется и может превысить полное).
+    Апдейты дольше slow_threshold секунд пишутся в лог с именем хендлера и состоянием FSM.
+    Доля sample_rate апдейтов снимается cProfile в dump_dir (хранятся последние max_dumps файлов).
+    cProfile видит весь поток, поэтому в снимок попадают и апдейты, обрабатывавшиеся параллельно
+    """
+
+    def __init__(self, slow_threshold: float = 2.0, sample_rate: float = 0.0, dump_dir: str = "profiles",
+                 max_dumps: int = 100):
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.dump_dir = dump_dir
+        self.max_dumps = max_dumps
+        self.slow = 0
+        self.dumps = 0
+        # В потоке может работать только один профилировщик
+        self._profiling = False
+
+    async def __call__(self, handler, event, data: dict):
+        update = {"times": defaultdict(float), "handler": None, "state": None}
+        token = _update.set(update)
+        profiler = None
+        if self.sample_rate and not self._profiling and random.random() < self.sample_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            _update.reset(token)
+            if elapsed >= self.slow_threshold:
+                self.slow += 1
+                print(self._describe(event, update, elapsed))
+            if profiler is not None:
+                await self._dump(profiler, event, update)
+
+    @staticmethod
+    def _describe(event, update: dict, elapsed: float) -> str:
+        times = update["times"]
+        other = max(elapsed - sum(times.values()), 0)
+        parts = ", ".join(f"{kind} {times[kind]:.2f} с" for kind in KINDS)
+        return (f"Медленный апдейт {event.update_id}: {elapsed:.2f} с, хендлер {update['handler']}, "
+                f"состояние {update['state']}; {parts}, прочее {other:.2f} с")
+
+    async def _dump(self, profiler: cProfile.Profile, event, update: dict):
+        name = f"{int(time.time() * 1000)}_{event.update_id}_{update['handler'] or 'none'}.prof"
+        try:
+            await asyncio.to_thread(self._write, profiler, os.path.join(self.dump_dir, name))
+            self.dumps += 1
+        except OSError as e:
+            print(f"Не удалось сохранить профиль апдейта {event.update_id}: {e}")
+
+    def _write(self, profiler: cProfile.Profile, path: str):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        profiler.dump_stats(path)
+        files = sorted((entry for entry in os.scandir(self.dump_dir) if entry.name.endswith(".prof")),
+                       key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:max(len(files) - self.max_dumps, 0)]:
+            os.remove(entry.path)
@@ -0,0 +1,52 @@
+import asyncio
+
+from database import AsyncDatabase
+
+HASHTAGS_HINT = "Используй при создании постов хештэги."
+
+
+class SystemPromptStore:
+    """
+    Собранные системные промпты организаций.
+    Роль НКО строится моделью (create_system_prompt) только при изменении описания организации.
+    В organizations хранится промпт организации без настроек пользователя, он общий для всех её участников;
+    стиль, тон и размер каждого пользователя добавляются при чтении, без запроса к модели.
+    """
+
+    def __init__(self, db: AsyncDatabase, ai):
+        self.db = db
+        self.ai = ai
+
+    async def get(self, user_id: int):
+        """Системный промпт с настройками пользователя и роль организации или (None, None), если роли ещё нет"""
+        settings, row = await asyncio.gather(self.db.get_user_settings(user_id),
+                                             self.db.get_system_prompt(user_id))
+        if not row or not row[0]:
+            return None, None
+        return self._compose(settings, row[0]), row[1]
+
+    async def _build_role(self, user_id: int, description: str) -> str:
+        name = (await self.db.get_organization_info(user_id) or (None, ""))[1]
+        source = f"Название: {name}\n{description}"
+        try:
+            return (await self.ai.create_system_prompt(source)).output_text
+        except Exception as e:
+            # Без роли от модели используем описание как есть, чтобы промпт всё равно был собран
+            print(f"Не удалось собрать роль организации для {user_id}: {e!r}")
+            return source
+
+    def _compose(self, settings: dict, organization_prompt: str) -> str:
+        prefix = self.ai.prompt_from_settings(settings) if settings else ""
+        if settings and str(settings.get("set_org_info", 1)) == "0":
+            # Пользователь отключил учёт информации об организации
+            return prefix + HASHTAGS_HINT
+        return prefix + organization_prompt
+
+    async def rebuild(self, user_id: int, info: str):
+        """
+        Построить роль организации по новому описанию и сохранить промпт организации
+        :param user_id:
+        :param info: новое описание организации
+        """
+        role = await self._build_role(user_id, info)
+        await self.db.save_system_prompt(user_id, role + HASHTAGS_HINT, role)
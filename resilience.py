@@ -0,0 +1,193 @@
+import asyncio
+import random
+import time
+from collections import Counter, deque
+
+import grpc
+import openai
+
+import metrics
+
+RETRYABLE_GRPC_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.INTERNAL,
+}
+
+# Числовые значения состояний автомата для метрики circuit_state
+CIRCUIT_STATES = {"closed": 0, "half-open": 1, "open": 2}
+
+
+class CircuitOpenError(Exception):
+    """Сервис генерации признан недоступным, запрос отклонён без обращения к нему"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Временные ошибки: 429, 5xx, обрывы соединения и таймауты"""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    if isinstance(error, grpc.aio.AioRpcError):
+        return error.code() in RETRYABLE_GRPC_CODES
+    return False
+
+
+def retry_after(error: BaseException):
+    """Задержка из заголовка Retry-After, если сервер её прислал"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Следит за долей временных ошибок среди последних window вызовов.
+    Если она достигла failure_ratio (при хотя бы min_calls вызовах), размыкается на reset_timeout секунд.
+    Затем пропускает один пробный запрос: успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_ratio: float = 0.5, window: int = 20, min_calls: int = 10,
+                 reset_timeout: float = 30):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self._probe = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probe:
+            self._probe = True
+            return True
+        return False
+
+    def success(self):
+        self.outcomes.append(True)
+        if self.opened_at is not None:
+            self.outcomes.clear()
+        self.opened_at = None
+        self._probe = False
+
+    def cancelled(self):
+        """Вызов отменён, исход неизвестен: следующий вызов в полуоткрытом состоянии снова станет пробным"""
+        self._probe = False
+
+    def failure(self) -> bool:
+        """Учесть ошибку; True, если цепь только что разомкнулась"""
+        self.outcomes.append(False)
+        self._probe = False
+        if self.opened_at is not None:
+            # Не прошёл пробный запрос: снова ждём reset_timeout
+            self.opened_at = time.monotonic()
+            return False
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_ratio:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+class Resilience:
+    """
+    Таймаут на операцию, повторы с экспоненциальной задержкой и джиттером, автоматы по сервисам.
+    Счётчики дублируются в /metrics, состояние автоматов туда снимает Bot.collect_metrics
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8,
+                 failure_ratio: float = 0.5, reset_timeout: float = 30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_ratio = failure_ratio
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        # Счётчики по операциям
+        self.retries = Counter()
+        self.failures = Counter()
+        self.rejected = Counter()
+        self.circuit_opened = Counter()
+
+    def breaker(self, service: str) -> CircuitBreaker:
+        if service not in self.breakers:
+            self.breakers[service] = CircuitBreaker(self.failure_ratio, reset_timeout=self.reset_timeout)
+        return self.breakers[service]
+
+    def _delay(self, attempt: int, error: BaseException) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            # Full jitter: случайная задержка до экспоненциальной границы
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return delay
+
+    async def call(self, service: str, operation: str, func, budget: float):
+        """
+        Выполнить func() с повторами, уложившись в budget секунд на все попытки
+        :param service: имя сервиса для автомата (llm, art)
+        :param operation: имя операции для метрик
+        :param func: корутина-функция без аргументов
+        :param budget: общий бюджет времени в секундах
+        :return:
+        """
+        breaker = self.breaker(service)
+        deadline = time.monotonic() + budget
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.rejected[operation] += 1
+                metrics.RESILIENCE_REJECTED.inc(operation=operation)
+                raise CircuitOpenError(f"Сервис {service} временно недоступен")
+
+            remaining = deadline - time.monotonic()
+            try:
+                result = await asyncio.wait_for(func(), timeout=max(remaining, 0.001))
+            except asyncio.CancelledError:
+                # Иначе флаг пробного запроса останется, и автомат будет отклонять все вызовы
+                breaker.cancelled()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # Ошибка в самом запросе, но сервис ответил, значит он доступен
+                    breaker.success()
+                    raise
+                self.failures[operation] += 1
+                metrics.RESILIENCE_FAILURES.inc(operation=operation)
+                if breaker.failure():
+                    self.circuit_opened[service] += 1
+                    metrics.CIRCUIT_OPENED.inc(service=service)
+                    print(f"Автомат {service} разомкнут после ошибки в {operation}: {e!r}")
+                attempt += 1
+                delay = self._delay(attempt, e)
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise
+                self.retries[operation] += 1
+                metrics.RESILIENCE_RETRIES.inc(operation=operation)
+                await asyncio.sleep(delay)
+                continue
+            breaker.success()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "retries": dict(self.retries),
+            "failures": dict(self.failures),
+            "rejected": dict(self.rejected),
+            "circuit_opened": dict(self.circuit_opened),
+            "circuits": {service: breaker.state for service, breaker in self.breakers.items()}
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai.types.responses import Response
+
+from cache import TTLCache
+
+
+def _normalize(value):
+    """Схлопывает пробелы в тексте запроса, чтобы мелкие отличия не давали промахов"""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+
+class ResponseCache:
+    """
+    Кэш ответов модели по содержимому запроса: в памяти (LRU) и, если задан path, в файле SQLite.
+    Используется только для операций из operations — детерминированных правок текста.
+    """
+
+    def __init__(self, operations=(), maxsize: int = 1000, ttl: float = 86400, path: str = None):
+        self.operations = frozenset(operations)
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self._conn = None
+        if path:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response_cache")
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                                      cache_key TEXT PRIMARY KEY,
+                                      response TEXT NOT NULL,
+                                      created_at REAL NOT NULL
+                                  )""")
+            self._conn.commit()
+
+    def enabled(self, operation: str) -> bool:
+        return operation in self.operations
+
+    @staticmethod
+    def key(operation: str, model: str, temperature, request_input) -> str:
+        digest = hashlib.sha256(
+            json.dumps(_normalize(request_input), ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+        return f"{operation}:{model}:{temperature}:{digest}"
+
+    async def _disk(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _disk_get(self, key: str):
+        row = self._conn.execute("SELECT response, created_at FROM response_cache WHERE cache_key = ?",
+                                 (key,)).fetchone()
+        if row and row[1] + self.ttl > time.time():
+            return row[0]
+        return None
+
+    def _disk_set(self, key: str, value: str):
+        self._conn.execute("""INSERT INTO response_cache (cache_key, response, created_at) VALUES (?, ?, ?)
+                              ON CONFLICT(cache_key) DO UPDATE SET response = excluded.response,
+                                                                   created_at = excluded.created_at""",
+                           (key, value, time.time()))
+        self._conn.commit()
+
+    async def get(self, key: str):
+        response = self.memory.get(key, None)
+        if response is not None or self._conn is None:
+            return response
+        raw = await self._disk(self._disk_get, key)
+        if raw is None:
+            return None
+        # Как и клиент openai, собираем ответ без строгой валидации: API Яндекса отдаёт не все поля
+        response = Response.construct(**json.loads(raw))
+        self.memory.set(key, response)
+        return response
+
+    async def set(self, key: str, response):
+        self.memory.set(key, response)
+        if self._conn is not None:
+            await self._disk(self._disk_set, key, response.model_dump_json())
+
+    def stats(self) -> dict:
+        return self.memory.stats()
+
+    def close(self):
+        if self._conn is not None:
+            self._executor.shutdown(wait=True)
+            self._conn.close()
@@ -0,0 +1,100 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Модель для операции. temperature и max_output_tokens, если не заданы, остаются как в коде операции.
+    Если основная модель не ответила за timeout секунд или недоступна, запрос уходит в fallback
+    """
+    model: str
+    temperature: Optional[float] = None
+    max_output_tokens: Optional[int] = None
+    fallback: Optional[str] = None
+    timeout: Optional[float] = None
+    min_input_tokens: int = 0
+
+
+DEFAULT_ROUTE = Route("default")
+
+
+def _route(item: dict, where: str, models: dict) -> Route:
+    if not isinstance(item, dict) or "model" not in item:
+        raise ValueError(f"models.json: в {where} нужен объект с полем 'model'")
+    unknown = set(item) - set(Route.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"models.json: неизвестные поля в {where}: {', '.join(sorted(unknown))}")
+    for field in ("model", "fallback"):
+        name = item.get(field)
+        if name is not None and name not in models and name != "default" and "/" not in name:
+            raise ValueError(f"models.json: модель '{name}' в {where} не описана в 'models'")
+    return Route(
+        model=item["model"],
+        temperature=None if item.get("temperature") is None else float(item["temperature"]),
+        max_output_tokens=None if item.get("max_output_tokens") is None else int(item["max_output_tokens"]),
+        fallback=item.get("fallback"),
+        timeout=None if item.get("timeout") is None else float(item["timeout"]),
+        min_input_tokens=int(item.get("min_input_tokens", 0))
+    )
+
+
+def parse_routes(raw: dict):
+    """
+    Таблица маршрутов из models.json
+    :return: (имена моделей -> имя или URI, маршрут по умолчанию, операция -> маршруты по убыванию min_input_tokens)
+    """
+    models = raw.get("models", {})
+    if not isinstance(models, dict):
+        raise ValueError("models.json: 'models' должен быть объектом")
+    default = _route(raw["default"], "'default'", models) if "default" in raw else DEFAULT_ROUTE
+    operations = {}
+    for operation, items in raw.get("operations", {}).items():
+        items = items if isinstance(items, list) else [items]
+        routes = [_route(item, f"операции '{operation}'", models) for item in items]
+        operations[operation] = sorted(routes, key=lambda route: route.min_input_tokens, reverse=True)
+    return models, default, operations
+
+
+class ModelRouter:
+    """
+    Выбор модели по операции и длине запроса.
+    Модель задаётся именем из раздела models, именем модели каталога (yandexgpt-lite/latest) или полным URI;
+    имя default — модель из MODEL в .env. Без таблицы все операции идут в default, как раньше
+    """
+
+    def __init__(self, folder: str, default_model: str, table: dict = None):
+        self.folder = folder
+        self.default_model = default_model
+        self.models, self.default, self.operations = parse_routes(table or {})
+
+    @classmethod
+    def from_file(cls, path: str, folder: str, default_model: str) -> "ModelRouter":
+        """Таблица из файла; если файла нет, роутер направляет всё в модель по умолчанию"""
+        if not path or not os.path.exists(path):
+            return cls(folder, default_model)
+        with open(path, "r", encoding="utf-8") as file:
+            return cls(folder, default_model, json.load(file))
+
+    def uri(self, name: str) -> str:
+        model = self.default_model if name == "default" else self.models.get(name, name)
+        if model and "://" in model:
+            return model
+        return f"gpt://{self.folder}/{model}"
+
+    def route(self, operation: str, input_tokens: int = 0) -> Route:
+        """Маршрут с наибольшим min_input_tokens, не превышающим длину запроса"""
+        for route in self.operations.get(operation, ()):
+            if input_tokens >= route.min_input_tokens:
+                return route
+        return self.default
+
+    def apply(self, route: Route, request: dict):
+        """Подставить в параметры запроса модель и переопределённые маршрутом параметры"""
+        request["model"] = self.uri(route.model)
+        if route.temperature is not None:
+            request["temperature"] = route.temperature
+        if route.max_output_tokens is not None:
+            request["max_output_tokens"] = route.max_output_tokens
@@ -0,0 +1,98 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+
+
+class FairScheduler:
+    """
+    Планировщик запросов к модели.
+    Одновременно выполняется не больше max_in_flight запросов и не больше одного на пользователя;
+    ожидающие пользователи обслуживаются по кругу, так что один активный пользователь не вытесняет остальных.
+    """
+
+    def __init__(self, max_in_flight: int = 10):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._active = set()
+        self._waiters = defaultdict(deque)
+        # Пользователи, у которых есть ожидающий запрос и нет выполняющегося, в порядке очереди
+        self._ring = deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def position(self, user_id: int) -> int:
+        """Сколько пользователей обслужат раньше user_id"""
+        if user_id in self._ring:
+            return self._ring.index(user_id)
+        return len(self._ring)
+
+    def _dispatch(self):
+        while self.in_flight < self.max_in_flight and self._ring:
+            user_id = self._ring.popleft()
+            waiters = self._waiters[user_id]
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                del self._waiters[user_id]
+                continue
+            self._active.add(user_id)
+            self.in_flight += 1
+            waiters.popleft().set_result(None)
+            if not waiters:
+                del self._waiters[user_id]
+
+    def _release(self, user_id: int):
+        self._active.discard(user_id)
+        self.in_flight -= 1
+        if self._waiters.get(user_id):
+            self._ring.append(user_id)
+        self._dispatch()
+
+    async def _acquire(self, user_id: int, on_queued=None):
+        if self.in_flight < self.max_in_flight and user_id not in self._active and not self._ring:
+            self._active.add(user_id)
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[user_id].append(future)
+        if user_id not in self._active and user_id not in self._ring:
+            self._ring.append(user_id)
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(self.position(user_id))
+                except Exception as e:
+                    # Не удалось сообщить о месте в очереди — сам запрос от этого не страдает
+                    print(f"Не удалось уведомить пользователя {user_id} об очереди: {e}")
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но запрос отменили — возвращаем слот
+                self._release(user_id)
+            else:
+                future.cancel()
+                waiters = self._waiters.get(user_id)
+                if waiters is not None:
+                    if future in waiters:
+                        waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[user_id]
+                        if user_id in self._ring:
+                            self._ring.remove(user_id)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, on_queued=None):
+        """
+        Занять слот для запроса пользователя
+        :param user_id:
+        :param on_queued: корутина-функция, вызывается с числом пользователей впереди, если запрос встал в очередь
+        """
+        await self._acquire(user_id, on_queued)
+        try:
+            yield
+        finally:
+            self._release(user_id)
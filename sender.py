@@ -0,0 +1,165 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+import metrics
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Telegram не принимает пустые сообщения, вместо пустого ответа модели отправляем это
+EMPTY_TEXT = "Не удалось получить ответ"
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Разбить текст на части не длиннее limit.
+    Режем по границе абзаца, если её нет — по переносу строки, затем по пробелу и только потом посреди слова.
+    Пустой текст или текст из одних пробелов даёт пустой список
+    """
+    parts = []
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit + 1)
+            # Слишком короткий кусок хуже разрыва строки внутри абзаца
+            if cut > limit // 2:
+                break
+        if cut <= 0:
+            cut = limit
+        part, text = text[:cut].rstrip(), text[cut:].lstrip()
+        if part:
+            parts.append(part)
+    if text.strip():
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """
+    Ведро токенов: rate токенов в секунду, не больше capacity подряд.
+    reserve() сразу забирает токен и возвращает, сколько ждать; токены уходят в минус,
+    так что ожидающие обслуживаются по очереди без блокировок
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return max(-self.tokens / self.rate, 0.0)
+
+    def hold(self, seconds: float):
+        """Ничего не выдавать ближайшие seconds секунд (ответ Telegram с retry_after)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class TelegramSender:
+    """
+    Исходящие сообщения бота в пределах лимитов Telegram: около 30 сообщений в секунду на бота,
+    около одного в секунду в личный чат и 20 в минуту в группу.
+    Как middleware сессии aiogram ограничивает все методы отправки (send*, copy*, forward*),
+    включая message.answer в хендлерах, и повторяет запрос после TelegramRetryAfter.
+    send() режет длинный текст по абзацам, broadcast() рассылает по многим чатам параллельно
+    """
+
+    def __init__(self, rate: float = 30, chat_rate: float = 1, group_rate: float = 20 / 60, chat_burst: float = 5,
+                 max_retries: int = 3, limit: int = MESSAGE_LIMIT, max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.limit = limit
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(rate, rate)
+        self._chats = {}
+        self.retried = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Полное ведро ничем не отличается от нового, такие можно забыть
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle()}
+            # Отрицательные id — группы и каналы
+            rate = self.group_rate if isinstance(chat_id, str) or chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _wait(self, chat_id):
+        start = time.perf_counter()
+        # Глобальный токен берём после ожидания чата, чтобы не занимать его впустую
+        await asyncio.sleep(self._chat_bucket(chat_id).reserve())
+        await asyncio.sleep(self.global_bucket.reserve())
+        metrics.TELEGRAM_THROTTLE_SECONDS.observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _limited(method) -> bool:
+        name = getattr(method, "__api_method__", "")
+        return name.startswith(("send", "copy", "forward")) and name != "sendChatAction"
+
+    async def __call__(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not self._limited(method):
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self._wait(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                metrics.TELEGRAM_RETRY_AFTER.inc()
+                # Следующая отправка в этот чат подождёт, сколько попросил Telegram
+                self._chat_bucket(chat_id).hold(e.retry_after)
+
+    async def send(self, bot: Bot, chat_id, text: str, **kwargs) -> list:
+        """
+        Отправить текст любой длины несколькими сообщениями
+        :param bot:
+        :param chat_id:
+        :param text:
+        :param kwargs: параметры send_message; клавиатура прикрепляется к последней части
+        :return: отправленные сообщения
+        """
+        reply_markup = kwargs.pop("reply_markup", None)
+        parts = split_text(text, self.limit) or [EMPTY_TEXT]
+        messages = []
+        for number, part in enumerate(parts, 1):
+            messages.append(await bot.send_message(chat_id, part,
+                                                   reply_markup=reply_markup if number == len(parts) else None,
+                                                   **kwargs))
+        return messages
+
+    async def broadcast(self, bot: Bot, chat_ids, text: str, concurrency: int = 50, **kwargs) -> int:
+        """
+        Разослать текст по чатам; темп задают лимиты, ошибки отдельных чатов не прерывают рассылку
+        :return: в сколько чатов сообщение доставлено
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def deliver(chat_id) -> bool:
+            async with semaphore:
+                try:
+                    await self.send(bot, chat_id, text, **kwargs)
+                    return True
+                except TelegramAPIError as e:
+                    print(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                    return False
+
+        return sum(await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids)))
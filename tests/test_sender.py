@@ -0,0 +1,28 @@
+import asyncio
+
+from sender import EMPTY_TEXT, TelegramSender, split_text
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.sent.append((chat_id, text, reply_markup))
+        return text
+
+
+def test_split_text_empty():
+    assert split_text("") == []
+    assert split_text(" \n\n ") == []
+
+
+def test_split_text_long():
+    parts = split_text("слово " * 2000, limit=100)
+    assert all(0 < len(part) <= 100 for part in parts)
+
+
+def test_send_empty_text_sends_placeholder():
+    bot = FakeBot()
+    asyncio.run(TelegramSender().send(bot, 1, "  ", reply_markup="keyboard"))
+    assert bot.sent == [(1, EMPTY_TEXT, "keyboard")]
@@ -0,0 +1,158 @@
+import hashlib
+import math
+import re
+from collections import Counter
+
+from cache import TTLCache
+
+
+def estimate_tokens(text: str, chars_per_token: float = 3.0) -> int:
+    """
+    Грубая оценка числа токенов без токенизатора модели.
+    Для русского текста у YandexGPT выходит примерно 3 символа на токен
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / chars_per_token)
+
+
+def truncate(text: str, max_tokens: int, chars_per_token: float = 3.0) -> str:
+    """Обрезает текст до max_tokens, по возможности по границе абзаца или предложения"""
+    limit = int(max_tokens * chars_per_token)
+    if len(text) <= limit:
+        return text
+    # Место под «…», чтобы результат не выходил за max_tokens
+    limit = max(limit - 1, 0)
+    cut = text[:limit]
+    # Не режем посреди предложения, если граница есть во второй половине отрезка
+    boundary = max(cut.rfind("\n"), *(match.end() for match in re.finditer(r"[.!?…]\s", cut)), -1)
+    if boundary > limit // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + "…"
+
+
+def parse_budgets(value: str) -> dict:
+    """Разбирает строку вида «dialogue:4000,content_plan:5000»"""
+    budgets = {}
+    for item in value.split(","):
+        if ":" in item:
+            operation, limit = item.split(":", 1)
+            budgets[operation.strip()] = int(limit)
+    return budgets
+
+
+class TokenBudget:
+    """
+    Учёт токенов в запросах к модели.
+    Следит, чтобы вход каждой операции укладывался в бюджет, сокращает длинные описания организаций
+    один раз с кэшированием результата и копит фактический расход токенов из response.usage.
+    """
+
+    def __init__(self, default: int = 6000, budgets: dict = None, info_limit: int = 1000,
+                 chars_per_token: float = 3.0, cache_size: int = 1000, cache_ttl: float = 86400,
+                 log_usage: bool = False):
+        self.default = default
+        self.budgets = budgets or {}
+        self.info_limit = info_limit
+        self.chars_per_token = chars_per_token
+        self.log_usage = log_usage
+        self.compacted = TTLCache(cache_size, cache_ttl)
+        # Счётчики по операциям
+        self.requests = Counter()
+        self.input_tokens = Counter()
+        self.output_tokens = Counter()
+        self.trimmed = Counter()
+
+    def limit(self, operation: str) -> int:
+        return self.budgets.get(operation, self.default)
+
+    def estimate(self, request_input) -> int:
+        """Оценка токенов во входе запроса: строка или список сообщений"""
+        if isinstance(request_input, str):
+            return estimate_tokens(request_input, self.chars_per_token)
+        return sum(estimate_tokens(message.get("content") or "", self.chars_per_token) + 4
+                   for message in request_input)
+
+    def fit(self, operation: str, request_input):
+        """
+        Укладывает вход в бюджет операции.
+        Сначала сокращаются самые длинные сообщения перед последним, запрос пользователя — в последнюю очередь
+        :param operation:
+        :param request_input: строка или список сообщений
+        :return: вход запроса, при необходимости сокращённый
+        """
+        limit = self.limit(operation)
+        excess = self.estimate(request_input) - limit
+        if excess <= 0:
+            return request_input
+        self.trimmed[operation] += 1
+        if isinstance(request_input, str):
+            return truncate(request_input, limit, self.chars_per_token)
+
+        messages = [dict(message) for message in request_input]
+        # Короче этого сообщения не режем, чтобы они не теряли смысл
+        floor = max(limit // (4 * len(messages)), 16)
+        for candidates in (messages[:-1], messages[-1:]):
+            # Каждый проход укорачивает одно сообщение, так что проходов не больше, чем сообщений, с запасом
+            for _ in range(4 * len(candidates)):
+                if excess <= 0:
+                    break
+                tokens, message = max(((estimate_tokens(m.get("content") or "", self.chars_per_token), m)
+                                       for m in candidates), key=lambda item: item[0], default=(0, None))
+                if message is None or tokens <= floor:
+                    break
+                target = max(tokens - excess, floor)
+                message["content"] = truncate(message["content"], target, self.chars_per_token)
+                saved = tokens - estimate_tokens(message["content"], self.chars_per_token)
+                if saved <= 0:
+                    break
+                excess -= saved
+        if excess > 0:
+            print(f"Вход операции {operation} не уложился в бюджет {limit} токенов, лишних ~{excess}")
+        return messages
+
+    def needs_compaction(self, info: str) -> bool:
+        return estimate_tokens(info, self.chars_per_token) > self.info_limit
+
+    async def compact(self, info: str, summarize) -> str:
+        """
+        Сокращённое описание организации; модель вызывается один раз на каждое новое описание
+        :param info: исходное описание
+        :param summarize: корутина-функция (текст, лимит токенов) -> ответ модели
+        :return:
+        """
+        if not info or not self.needs_compaction(info):
+            return info
+        key = hashlib.sha256(info.encode()).hexdigest()
+        short = self.compacted.get(key, None)
+        if short is not None:
+            return short
+        try:
+            short = (await summarize(info, self.info_limit)).output_text
+        except Exception as e:
+            print(f"Не удалось сократить описание организации: {e!r}")
+            short = ""
+        if not short or self.needs_compaction(short):
+            short = truncate(short or info, self.info_limit, self.chars_per_token)
+        self.compacted.set(key, short)
+        return short
+
+    def record(self, operation: str, response, estimated: int = None):
+        """Учесть расход токенов по response.usage"""
+        usage = getattr(response, "usage", None)
+        input_tokens = getattr(usage, "input_tokens", None) or 0
+        output_tokens = getattr(usage, "output_tokens", None) or 0
+        self.requests[operation] += 1
+        self.input_tokens[operation] += input_tokens
+        self.output_tokens[operation] += output_tokens
+        if self.log_usage:
+            print(f"Токены {operation}: вход {input_tokens} (оценка {estimated}), выход {output_tokens}")
+
+    def stats(self) -> dict:
+        return {
+            "requests": dict(self.requests),
+            "input_tokens": dict(self.input_tokens),
+            "output_tokens": dict(self.output_tokens),
+            "trimmed": dict(self.trimmed),
+            "compacted": self.compacted.stats()
+        }